@@ -4,110 +4,319 @@ Tests code compatibility across different MicroPython platforms
 """
 
 import ast
+import functools
+import json
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# Matches `from X import ...` (group 1) and `import X, Y as Z` (group 2).
+# Runs on raw bytes so sources never need decoding
+_IMPORT_RE = re.compile(
+    rb'^[ \t]*(?:from[ \t]+([\w.]+)[ \t]+import\b|import[ \t]+([^\n#;]+))',
+    re.M
+)
+_KEYWORD_RE = re.compile(rb'\w+')
+
+
+@functools.lru_cache(maxsize=None)
+def _read(path, mtime_ns):
+    """Read a source file as raw bytes (cached per modification time)"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def load_sources(code_dir):
+    """Read every Python file in code_dir once, as bytes keyed by path"""
+    sources = {}
+    with os.scandir(code_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.py') and entry.is_file(follow_symlinks=False):
+                sources[entry.path] = _read(entry.path, entry.stat().st_mtime_ns)
+    return sources
+
+
 class PlatformCompatibilityAnalyzer:
     """Analyze NexLattice code for platform compatibility"""
     
-    def __init__(self, code_dir='devices'):
-        self.code_dir = Path(code_dir)
-        self.platforms = {
-            'ESP32': {
-                'name': 'ESP32 (WROOM-32, WROVER)',
-                'micropython': True,
-                'network': True,
-                'socket': True,
-                'ucryptolib': True,
-                'uhashlib': True,
-                'ubinascii': True,
-                'urandom': True,
-                'threading': True,
-                'status': 'tested'
-            },
-            'Pico_W': {
-                'name': 'Raspberry Pi Pico W',
-                'micropython': True,
-                'network': True,
-                'socket': True,
-                'ucryptolib': True,
-                'uhashlib': True,
-                'ubinascii': True,
-                'urandom': True,
-                'threading': True,
-                'status': 'compatible'
-            },
-            'STM32_WiFi': {
-                'name': 'STM32 with WiFi (e.g., STM32F4 with ESP8266/ESP32)',
-                'micropython': True,
-                'network': True,
-                'socket': True,
-                'ucryptolib': True,
-                'uhashlib': True,
-                'ubinascii': True,
-                'urandom': True,
-                'threading': True,
-                'status': 'compatible'
-            },
-            'ESP8266': {
-                'name': 'ESP8266',
-                'micropython': True,
-                'network': True,
-                'socket': True,
-                'ucryptolib': False,  # Limited crypto support
-                'uhashlib': True,
-                'ubinascii': True,
-                'urandom': True,
-                'threading': True,
-                'status': 'compatible_with_fallback'
-            }
+    # import -> (required platform feature, fallback note). Imports with a
+    # fallback only warn; modules not listed (time, json, ...) work everywhere
+    _IMPORT_REQS = {
+        'network': ('network', None),
+        'socket': ('socket', None),
+        '_thread': ('threading', None),
+        'ucryptolib': ('ucryptolib', "fallback encryption will be used"),
+        'uhashlib': ('uhashlib', None),
+        'ubinascii': ('ubinascii', None),
+        'urandom': ('urandom', None),
+    }
+    _INTERESTING = frozenset(_IMPORT_REQS)
+    
+    # Platform capability table (shared, read-only)
+    PLATFORMS = {
+        'ESP32': {
+            'name': 'ESP32 (WROOM-32, WROVER)',
+            'micropython': True,
+            'network': True,
+            'socket': True,
+            'ucryptolib': True,
+            'uhashlib': True,
+            'ubinascii': True,
+            'urandom': True,
+            'threading': True,
+            'status': 'tested'
+        },
+        'Pico_W': {
+            'name': 'Raspberry Pi Pico W',
+            'micropython': True,
+            'network': True,
+            'socket': True,
+            'ucryptolib': True,
+            'uhashlib': True,
+            'ubinascii': True,
+            'urandom': True,
+            'threading': True,
+            'status': 'compatible'
+        },
+        'STM32_WiFi': {
+            'name': 'STM32 with WiFi (e.g., STM32F4 with ESP8266/ESP32)',
+            'micropython': True,
+            'network': True,
+            'socket': True,
+            'ucryptolib': True,
+            'uhashlib': True,
+            'ubinascii': True,
+            'urandom': True,
+            'threading': True,
+            'status': 'compatible'
+        },
+        'ESP8266': {
+            'name': 'ESP8266',
+            'micropython': True,
+            'network': True,
+            'socket': True,
+            'ucryptolib': False,  # Limited crypto support
+            'uhashlib': True,
+            'ubinascii': True,
+            'urandom': True,
+            'threading': True,
+            'status': 'compatible_with_fallback'
         }
+    }
+    
+    def __init__(self, code_dir='devices', cache_file=None):
+        self.code_dir = Path(code_dir)
+        self.cache_file = Path(cache_file) if cache_file else Path(__file__).with_name('.analyzer_cache.json')
+        self.platforms = self.PLATFORMS
         
         self.imports_found = set()
         self.files_analyzed = []
+        self._compat_cache = {}  # (platform_name, frozen imports): result
+        self._cache = self._load_cache()  # path: [mtime_ns, size, sorted imports]
         
-    def analyze_file(self, filepath):
+    def _load_cache(self):
+        """Load the import cache from a previous run"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_cache(self):
+        """Persist the import cache atomically"""
+        tmp_file = self.cache_file.with_name(self.cache_file.name + '.tmp')
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            print(f"⚠️  Could not save analyzer cache: {e}")
+    
+    def analyze_file(self, filepath, content=None):
         """Analyze a Python file for imports and dependencies"""
+        imports = self._scan_file(filepath, content)
+        if imports is None:
+            return False
+        
+        self.imports_found.update(imports)
+        self.files_analyzed.append(os.fspath(filepath))
+        return True
+    
+    def _scan_file(self, filepath, content=None):
+        """Return the modules imported by a file, or None on error
+        
+        Does not touch imports_found, so it is safe to run from worker threads.
+        """
+        # DirEntry objects from analyze_codebase carry a cached stat result
+        entry = filepath if isinstance(filepath, os.DirEntry) else None
+        filepath = os.fspath(filepath)
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
+            st = entry.stat() if entry else os.stat(filepath)
+            cache_key = filepath
             
-            # Parse AST
-            tree = ast.parse(content)
+            cached = self._cache.get(cache_key)
+            if cached and cached[:2] == [st.st_mtime_ns, st.st_size]:
+                return cached[2]
             
-            # Find all imports
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Import):
-                    for alias in node.names:
-                        self.imports_found.add(alias.name)
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module:
-                        self.imports_found.add(node.module)
+            if content is None:
+                with open(filepath, 'rb') as f:
+                    content = f.read()
             
-            self.files_analyzed.append(str(filepath))
-            return True
+            imports = sorted(self._scan_imports(content))
+            self._cache[cache_key] = [st.st_mtime_ns, st.st_size, imports]
+            return imports
         except Exception as e:
             print(f"❌ Error analyzing {filepath}: {e}")
-            return False
+            return None
+    
+    def _scan_imports(self, content):
+        """Collect imported module names with a line-based regex scan
+        
+        Like _scan_imports_ast, only module-level imports count, including
+        those nested in if/try blocks; function and class bodies are skipped.
+        """
+        imports = set()
+        
+        for match in _IMPORT_RE.finditer(content):
+            line = match.group(0)
+            indent = len(line) - len(line.lstrip(b' \t'))
+            if indent and not self._in_module_scope(content, match.start(), indent):
+                continue
+            
+            module, names = match.groups()
+            if module:
+                module = module.lstrip(b'.')
+                if module:
+                    imports.add(module.decode())
+                continue
+            
+            names = names.strip()
+            if names.endswith(b'\\'):
+                # Line continuation - let the parser handle it
+                return self._scan_imports_ast(content)
+            
+            for name in names.split(b','):
+                # Drop any `as alias` suffix
+                parts = name.split()
+                if parts:
+                    imports.add(parts[0].decode())
+        
+        return imports
     
-    def analyze_codebase(self):
-        """Analyze all Python files in code directory"""
+    def _in_module_scope(self, content, line_start, indent):
+        """True if the line at line_start (indented by indent) is nested only in if/try blocks"""
+        pos = line_start
+        while indent:
+            if pos == 0:
+                return False
+            # Step back one line
+            prev = content.rfind(b'\n', 0, pos - 1) + 1
+            line = content[prev:pos - 1]
+            pos = prev
+            
+            stripped = line.lstrip(b' \t')
+            if not stripped.strip() or stripped.startswith(b'#'):
+                continue
+            line_indent = len(line) - len(stripped)
+            if line_indent >= indent:
+                continue
+            
+            keyword = _KEYWORD_RE.match(stripped)
+            keyword = keyword.group(0) if keyword else b''
+            if keyword in (b'else', b'elif', b'except', b'finally'):
+                # A later clause: the block's head is further up at the same indent
+                indent = line_indent + 1
+            elif keyword in (b'if', b'try'):
+                indent = line_indent
+            else:
+                return False
+        return True
+    
+    def _scan_imports_ast(self, content):
+        """Collect imported module names by parsing the file (slow path)"""
+        imports = set()
+        self._collect_imports(ast.parse(content).body, imports)
+        return imports
+    
+    def _collect_imports(self, stmts, imports):
+        """Collect imports from module-level statements
+        
+        Only descends into if/try blocks, where conditional and fallback
+        imports live; function and class bodies are skipped.
+        """
+        for node in stmts:
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    imports.add(alias.name)
+            elif isinstance(node, ast.ImportFrom):
+                if node.module:
+                    imports.add(node.module)
+            elif isinstance(node, ast.If):
+                self._collect_imports(node.body, imports)
+                self._collect_imports(node.orelse, imports)
+            elif isinstance(node, ast.Try):
+                self._collect_imports(node.body, imports)
+                for handler in node.handlers:
+                    self._collect_imports(handler.body, imports)
+                self._collect_imports(node.orelse, imports)
+                self._collect_imports(node.finalbody, imports)
+    
+    def analyze_codebase(self, sources=None):
+        """Analyze all Python files in code directory
+        
+        If sources (path -> source bytes, see load_sources) is given, files are
+        scanned from it instead of being read again.
+        """
         print("Analyzing NexLattice codebase for platform compatibility...\n")
         
-        python_files = list(self.code_dir.glob('*.py'))
+        if sources is not None:
+            jobs = list(sources.items())
+        else:
+            # Filter on the name before is_file() so non-Python entries never cost a stat
+            with os.scandir(self.code_dir) as it:
+                jobs = [(entry, None) for entry in it
+                        if entry.name.endswith('.py') and entry.is_file(follow_symlinks=False)]
+        
+        for path, _ in jobs:
+            print(f"  Analyzing {os.path.basename(path)}...")
+        
+        # Reads are I/O bound, so scan files concurrently and merge the
+        # results here on the calling thread
+        with ThreadPoolExecutor(max_workers=max(1, min(32, len(jobs)))) as executor:
+            scanned = list(executor.map(lambda job: self._scan_file(*job), jobs))
+        
+        for (path, _), imports in zip(jobs, scanned):
+            if imports is not None:
+                self.imports_found.update(imports)
+                self.files_analyzed.append(os.fspath(path))
         
-        for py_file in python_files:
-            print(f"  Analyzing {py_file.name}...")
-            self.analyze_file(py_file)
+        self._save_cache()
         
         print(f"\n[OK] Analyzed {len(self.files_analyzed)} files")
         print(f"[OK] Found {len(self.imports_found)} unique imports\n")
         
-        return self.imports_found
+        return frozenset(self.imports_found)
     
     def check_platform_compatibility(self, platform_name):
         """Check if code is compatible with a specific platform"""
+        imports = frozenset(self.imports_found)
+        
+        # Results only depend on the platform and the import set, so repeat
+        # calls with unchanged imports are served from the cache
+        cache_key = (platform_name, imports)
+        if cache_key not in self._compat_cache:
+            self._compat_cache[cache_key] = self._check(platform_name, imports)
+        
+        # Hand out copies so callers can't alter the cached result
+        result = self._compat_cache[cache_key]
+        if result is None:
+            return None
+        return dict(result, issues=list(result['issues']), warnings=list(result['warnings']))
+    
+    def _check(self, platform_name, imports):
+        """Evaluate platform compatibility for a set of imports"""
         platform = self.platforms.get(platform_name)
         if not platform:
             return None
@@ -115,44 +324,16 @@ class PlatformCompatibilityAnalyzer:
         issues = []
         warnings = []
         
-        # Check standard library imports
-        standard_imports = {
-            'network', 'socket', 'time', 'json', '_thread'
-        }
-        
-        # Check MicroPython-specific imports
-        micropython_imports = {
-            'ubinascii', 'uhashlib', 'urandom', 'ucryptolib'
-        }
-        
-        # Check each import
-        for imp in self.imports_found:
-            # Skip standard Python modules that work everywhere
-            if imp in ['time', 'json']:
+        # Only imports with platform requirements need checking
+        for imp in imports & self._INTERESTING:
+            feature, fallback = self._IMPORT_REQS[imp]
+            if platform[feature]:
                 continue
             
-            # Check MicroPython-specific modules
-            if imp == 'network':
-                if not platform['network']:
-                    issues.append(f"[ERROR] {imp} not available on {platform['name']}")
-            elif imp == 'socket':
-                if not platform['socket']:
-                    issues.append(f"[ERROR] {imp} not available on {platform['name']}")
-            elif imp == '_thread':
-                if not platform['threading']:
-                    issues.append(f"[ERROR] {imp} not available on {platform['name']}")
-            elif imp == 'ucryptolib':
-                if not platform['ucryptolib']:
-                    warnings.append(f"[WARN] {imp} not available on {platform['name']} (fallback encryption will be used)")
-            elif imp == 'uhashlib':
-                if not platform['uhashlib']:
-                    issues.append(f"[ERROR] {imp} not available on {platform['name']}")
-            elif imp == 'ubinascii':
-                if not platform['ubinascii']:
-                    issues.append(f"[ERROR] {imp} not available on {platform['name']}")
-            elif imp == 'urandom':
-                if not platform['urandom']:
-                    issues.append(f"[ERROR] {imp} not available on {platform['name']}")
+            if fallback:
+                warnings.append(f"[WARN] {imp} not available on {platform['name']} ({fallback})")
+            else:
+                issues.append(f"[ERROR] {imp} not available on {platform['name']}")
         
         return {
             'platform': platform,
@@ -217,30 +398,64 @@ class PlatformCompatibilityAnalyzer:
         
         return results
     
+    _MATRIX_HEADER = """# NexLattice Platform Compatibility Matrix
+**Generated:** Platform Compatibility Analysis
+
+| Platform | Status | Compatibility | Notes |
+|----------|--------|---------------|-------|
+"""
+    _MATRIX_ROW = "| {} | {} | {} | {} |"  # platform, status, compatibility, notes
+    
+    @staticmethod
+    def _matrix_cells(result):
+        """Return the (compatibility badge, notes) cells for a matrix row"""
+        if result['compatible'] and not result['warnings']:
+            return "✅ Fully Compatible", "All features supported"
+        if result['compatible']:
+            return "⚠️ Compatible (Fallbacks)", "Uses fallback encryption"
+        return "❌ Not Compatible", "; ".join(result['issues'][:2])
+    
     def generate_compatibility_matrix(self, results):
         """Generate compatibility matrix markdown"""
-        matrix = []
-        matrix.append("# NexLattice Platform Compatibility Matrix\n")
-        matrix.append("**Generated:** Platform Compatibility Analysis\n\n")
-        matrix.append("| Platform | Status | Compatibility | Notes |\n")
-        matrix.append("|----------|--------|---------------|-------|\n")
+        rows = [self._MATRIX_ROW.format(result['platform']['name'], result['status'],
+                                        *self._matrix_cells(result))
+                for result in results.values()]
+        
+        return self._MATRIX_HEADER + "\n".join(rows) + ("\n" if rows else "")
+    
+    def generate_detailed_analysis(self, results):
+        """Yield the detailed analysis markdown section by section"""
+        yield """
+
+## Detailed Analysis
+
+### Dependencies Required
+
+All platforms require MicroPython with the following modules:
+
+- `network` - WiFi connectivity
+- `socket` - UDP/TCP communication
+- `uhashlib` - Cryptographic hashing
+- `ubinascii` - Binary/hex encoding
+- `urandom` - Random number generation
+- `_thread` - Threading support
+- `ucryptolib` - AES encryption (optional, fallback available)
+
+### Platform-Specific Notes
+
+"""
         
         for platform_name, result in results.items():
             platform = result['platform']
-            
-            if result['compatible'] and not result['warnings']:
-                status = "✅ Fully Compatible"
-                notes = "All features supported"
-            elif result['compatible'] and result['warnings']:
-                status = "⚠️ Compatible (Fallbacks)"
-                notes = "Uses fallback encryption"
-            else:
-                status = "❌ Not Compatible"
-                notes = "; ".join(result['issues'][:2])
-            
-            matrix.append(f"| {platform['name']} | {result['status']} | {status} | {notes} |\n")
-        
-        return "".join(matrix)
+            compatibility = '✅ Compatible' if result['compatible'] else '❌ Not Compatible'
+            yield (f"#### {platform['name']}\n\n"
+                   f"- **Status**: {result['status']}\n"
+                   f"- **Compatibility**: {compatibility}\n")
+            if result['warnings']:
+                warning_texts = [w.split(':', 1)[1].strip() if ':' in w else w
+                                 for w in result['warnings']]
+                yield f"- **Warnings**: {', '.join(warning_texts)}\n"
+            yield "\n"
 
 
 def main():
@@ -255,34 +470,11 @@ def main():
     output_file = Path('compatibility/COMPATIBILITY_REPORT.md')
     output_file.parent.mkdir(exist_ok=True)
     
-    with open(output_file, 'w', encoding='utf-8') as f:
+    # Stream the sections through one buffered handle instead of joining
+    # the whole report in memory first
+    with open(output_file, 'w', encoding='utf-8', buffering=1 << 16) as f:
         f.write(matrix)
-        f.write("\n\n## Detailed Analysis\n\n")
-        f.write("### Dependencies Required\n\n")
-        f.write("All platforms require MicroPython with the following modules:\n\n")
-        f.write("- `network` - WiFi connectivity\n")
-        f.write("- `socket` - UDP/TCP communication\n")
-        f.write("- `uhashlib` - Cryptographic hashing\n")
-        f.write("- `ubinascii` - Binary/hex encoding\n")
-        f.write("- `urandom` - Random number generation\n")
-        f.write("- `_thread` - Threading support\n")
-        f.write("- `ucryptolib` - AES encryption (optional, fallback available)\n\n")
-        
-        f.write("### Platform-Specific Notes\n\n")
-        for platform_name, result in results.items():
-            platform = result['platform']
-            f.write(f"#### {platform['name']}\n\n")
-            f.write(f"- **Status**: {result['status']}\n")
-            f.write(f"- **Compatibility**: {'✅ Compatible' if result['compatible'] else '❌ Not Compatible'}\n")
-            if result['warnings']:
-                warning_texts = []
-                for w in result['warnings']:
-                    if ':' in w:
-                        warning_texts.append(w.split(':', 1)[1].strip())
-                    else:
-                        warning_texts.append(w)
-                f.write(f"- **Warnings**: {', '.join(warning_texts)}\n")
-            f.write("\n")
+        f.writelines(analyzer.generate_detailed_analysis(results))
     
     print("=" * 70)
     print(f"[OK] Compatibility report saved to: {output_file}")
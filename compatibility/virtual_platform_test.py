@@ -4,10 +4,56 @@ Simulates different MicroPython platforms to test compatibility
 """
 
 import sys
+import os
+import functools
 import importlib
-from unittest.mock import Mock, MagicMock, patch
+import re
+from pathlib import Path
+from types import SimpleNamespace as NS
 import json
 
+from platform_analyzer import load_sources
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# Byte strings the code compatibility rules look for (sources are not decoded)
+_MARKERS = (b'ucryptolib', b'network.WLAN', b'socket.socket', b'_thread')
+
+# A ucryptolib import inside a try block whose handler catches ImportError
+# at the same indentation, i.e. an import with a fallback
+_UCRYPTOLIB_FALLBACK_RE = re.compile(
+    rb'^([ \t]*)try:[ \t]*\n'
+    rb'(?:\1[ \t]+.*\n)*?'
+    rb'\1[ \t]+(?:import|from)[ \t]+ucryptolib\b.*\n'
+    rb'(?:(?:\1[ \t]+.*)?\n)*?'
+    rb'\1except[ \t]+ImportError\b',
+    re.M
+)
+
+if AHOCORASICK_AVAILABLE:
+    # pyahocorasick matches str; the markers are ASCII so latin-1 maps them 1:1
+    _MARKER_AUTOMATON = ahocorasick.Automaton()
+    for _marker in _MARKERS:
+        _MARKER_AUTOMATON.add_word(_marker.decode('latin-1'), _marker)
+    _MARKER_AUTOMATON.make_automaton()
+
+
+@functools.lru_cache(maxsize=None)
+def _find_markers(code):
+    """Return the markers present in code (one pass when pyahocorasick is installed)
+    
+    Cached per source, so the shared sources are scanned once no matter how
+    many platforms are tested.
+    """
+    if AHOCORASICK_AVAILABLE:
+        return frozenset(marker for _, marker in _MARKER_AUTOMATON.iter(code.decode('latin-1')))
+    return frozenset(marker for marker in _MARKERS if marker in code)
+
+
 class VirtualPlatform:
     """Simulates a MicroPython platform"""
     
@@ -18,170 +64,114 @@ class VirtualPlatform:
         self.setup_modules()
     
     def setup_modules(self):
-        """Setup mock modules for this platform"""
+        """Setup stand-in modules for this platform"""
         # Network module
         if self.features.get('network', False):
-            network = MagicMock()
-            wlan = MagicMock()
-            wlan.isconnected.return_value = True
-            wlan.ifconfig.return_value = ['192.168.1.100', '255.255.255.0', '192.168.1.1', '8.8.8.8']
-            wlan.connect.return_value = None
-            network.WLAN.return_value = wlan
-            network.STA_IF = 0
-            self.modules['network'] = network
+            wlan = NS(
+                isconnected=lambda: True,
+                ifconfig=lambda: ['192.168.1.100', '255.255.255.0', '192.168.1.1', '8.8.8.8'],
+                connect=lambda *args, **kwargs: None
+            )
+            self.modules['network'] = NS(WLAN=lambda *args, **kwargs: wlan, STA_IF=0)
         
         # Socket module
         if self.features.get('socket', False):
-            socket = MagicMock()
-            socket.AF_INET = 2
-            socket.SOCK_DGRAM = 2
-            socket.SOCK_STREAM = 1
-            socket.SOL_SOCKET = 1
-            socket.SO_REUSEADDR = 4
-            socket.SO_BROADCAST = 32
-            sock_instance = MagicMock()
-            sock_instance.bind.return_value = None
-            sock_instance.sendto.return_value = None
-            sock_instance.recvfrom.return_value = (b'data', ('192.168.1.101', 5001))
-            sock_instance.connect.return_value = None
-            sock_instance.send.return_value = None
-            socket.socket.return_value = sock_instance
-            self.modules['socket'] = socket
+            sock_instance = NS(
+                bind=lambda *args: None,
+                sendto=lambda *args: None,
+                recvfrom=lambda *args: (b'data', ('192.168.1.101', 5001)),
+                connect=lambda *args: None,
+                send=lambda *args: None
+            )
+            self.modules['socket'] = NS(
+                AF_INET=2,
+                SOCK_DGRAM=2,
+                SOCK_STREAM=1,
+                SOL_SOCKET=1,
+                SO_REUSEADDR=4,
+                SO_BROADCAST=32,
+                socket=lambda *args, **kwargs: sock_instance
+            )
         
         # Crypto modules
         if self.features.get('ucryptolib', False):
-            ucryptolib = MagicMock()
-            aes = MagicMock()
-            aes.encrypt.return_value = b'encrypted_data'
-            aes.decrypt.return_value = b'decrypted_data'
-            ucryptolib.aes.return_value = aes
-            self.modules['ucryptolib'] = ucryptolib
+            aes = NS(
+                encrypt=lambda data: b'encrypted_data',
+                decrypt=lambda data: b'decrypted_data'
+            )
+            self.modules['ucryptolib'] = NS(aes=lambda *args: aes)
         else:
             # Fallback - no ucryptolib
             self.modules['ucryptolib'] = None
         
         # Hashlib
         if self.features.get('uhashlib', False):
-            uhashlib = MagicMock()
-            sha256 = MagicMock()
-            sha256.digest.return_value = b'hash_digest'
-            sha256.hexdigest.return_value = 'hash_hex'
-            sha256.update.return_value = None
-            uhashlib.sha256.return_value = sha256
-            self.modules['uhashlib'] = uhashlib
+            sha256 = NS(
+                digest=lambda: b'hash_digest',
+                hexdigest=lambda: 'hash_hex',
+                update=lambda data: None
+            )
+            self.modules['uhashlib'] = NS(sha256=lambda *args: sha256)
         
         # Binascii
         if self.features.get('ubinascii', False):
-            ubinascii = MagicMock()
-            ubinascii.hexlify.return_value = b'hex_data'
-            ubinascii.unhexlify.return_value = b'bin_data'
-            self.modules['ubinascii'] = ubinascii
+            self.modules['ubinascii'] = NS(
+                hexlify=lambda data: b'hex_data',
+                unhexlify=lambda data: b'bin_data'
+            )
         
         # Random
         if self.features.get('urandom', False):
-            urandom = MagicMock()
-            urandom.getrandbits.return_value = 12345
-            self.modules['urandom'] = urandom
+            self.modules['urandom'] = NS(getrandbits=lambda bits: 12345)
         
         # Threading
         if self.features.get('threading', False):
-            _thread = MagicMock()
-            _thread.start_new_thread.return_value = None
-            self.modules['_thread'] = _thread
+            self.modules['_thread'] = NS(start_new_thread=lambda *args: None)
     
     def test_imports(self):
         """Test if all required imports work"""
-        results = {
-            'network': False,
-            'socket': False,
-            'ucryptolib': False,
-            'uhashlib': False,
-            'ubinascii': False,
-            'urandom': False,
-            '_thread': False
-        }
-        
-        try:
-            if self.modules.get('network'):
-                results['network'] = True
-        except:
-            pass
-        
-        try:
-            if self.modules.get('socket'):
-                results['socket'] = True
-        except:
-            pass
-        
-        try:
-            if self.modules.get('ucryptolib') is not None:
-                results['ucryptolib'] = self.features.get('ucryptolib', False)
-            else:
-                results['ucryptolib'] = False  # Not available, but code handles it
-        except:
-            pass
-        
-        try:
-            if self.modules.get('uhashlib'):
-                results['uhashlib'] = True
-        except:
-            pass
-        
-        try:
-            if self.modules.get('ubinascii'):
-                results['ubinascii'] = True
-        except:
-            pass
-        
-        try:
-            if self.modules.get('urandom'):
-                results['urandom'] = True
-        except:
-            pass
-        
-        try:
-            if self.modules.get('_thread'):
-                results['_thread'] = True
-        except:
-            pass
-        
+        results = {name: bool(self.modules.get(name)) for name in
+                   ('network', 'socket', 'ucryptolib', 'uhashlib', 'ubinascii', 'urandom', '_thread')}
+        # ucryptolib is optional - unavailable is fine, the code falls back
+        results['ucryptolib'] = bool(self.features.get('ucryptolib', False) and self.modules.get('ucryptolib'))
         return results
     
-    def test_code_compatibility(self, code_files):
-        """Test if code would work on this platform"""
+    def test_code_compatibility(self, sources):
+        """Test if code would work on this platform
+        
+        sources maps file path -> raw source bytes (see load_sources), so the
+        files are read once and shared across platforms.
+        """
         compatibility_results = []
         
-        for code_file in code_files:
+        for code_file, code in sources.items():
             try:
-                # Read and analyze code
-                with open(code_file, 'r') as f:
-                    code = f.read()
-                
                 # Check for platform-specific code
                 issues = []
                 warnings = []
+                found = _find_markers(code)
                 
                 # Check for ucryptolib usage
-                if 'ucryptolib' in code and not self.features.get('ucryptolib', False):
-                    if 'try:' in code and 'except ImportError:' in code:
+                if b'ucryptolib' in found and not self.features.get('ucryptolib', False):
+                    if _UCRYPTOLIB_FALLBACK_RE.search(code):
                         warnings.append(f"Uses ucryptolib with fallback (compatible)")
                     else:
                         issues.append(f"Uses ucryptolib without fallback")
                 
                 # Check for network usage
-                if 'network.WLAN' in code and not self.features.get('network', False):
+                if b'network.WLAN' in found and not self.features.get('network', False):
                     issues.append(f"Uses network.WLAN (not available)")
                 
                 # Check for socket usage
-                if 'socket.socket' in code and not self.features.get('socket', False):
+                if b'socket.socket' in found and not self.features.get('socket', False):
                     issues.append(f"Uses socket (not available)")
                 
                 # Check for threading
-                if '_thread' in code and not self.features.get('threading', False):
+                if b'_thread' in found and not self.features.get('threading', False):
                     issues.append(f"Uses _thread (not available)")
                 
                 compatibility_results.append({
-                    'file': code_file.name,
+                    'file': os.path.basename(code_file),
                     'compatible': len(issues) == 0,
                     'issues': issues,
                     'warnings': warnings
@@ -189,7 +179,7 @@ class VirtualPlatform:
                 
             except Exception as e:
                 compatibility_results.append({
-                    'file': code_file.name,
+                    'file': os.path.basename(code_file),
                     'compatible': False,
                     'issues': [f"Error analyzing: {str(e)}"],
                     'warnings': []
@@ -239,9 +229,7 @@ def test_platforms():
         }
     }
     
-    from pathlib import Path
-    code_dir = Path('devices')
-    code_files = list(code_dir.glob('*.py'))
+    sources = load_sources(Path('devices'))
     
     print("=" * 70)
     print("VIRTUAL PLATFORM COMPATIBILITY TESTING")
@@ -258,7 +246,7 @@ def test_platforms():
         import_results = platform.test_imports()
         
         # Test code compatibility
-        code_results = platform.test_code_compatibility(code_files)
+        code_results = platform.test_code_compatibility(sources)
         
         # Determine overall compatibility
         all_compatible = all(r['compatible'] for r in code_results)
@@ -288,13 +276,15 @@ def test_platforms():
 
 def generate_test_report(results):
     """Generate test report"""
-    report = []
-    report.append("# Virtual Platform Compatibility Test Report\n\n")
-    report.append("This report shows virtual testing results for NexLattice on different platforms.\n\n")
-    
-    report.append("## Test Results\n\n")
-    report.append("| Platform | Status | Imports | Code Files | Notes |\n")
-    report.append("|----------|--------|---------|------------|-------|\n")
+    report = ["""# Virtual Platform Compatibility Test Report
+
+This report shows virtual testing results for NexLattice on different platforms.
+
+## Test Results
+
+| Platform | Status | Imports | Code Files | Notes |
+|----------|--------|---------|------------|-------|
+"""]
     
     for platform_name, result in results.items():
         imports_ok = sum(result['imports'].values())
@@ -314,12 +304,15 @@ def generate_test_report(results):
     
     all_compatible = all(r['overall_compatible'] for r in results.values())
     if all_compatible:
-        report.append("✅ **All tested platforms are compatible with NexLattice.**\n\n")
-        report.append("The code uses proper fallback mechanisms for optional dependencies ")
-        report.append("(like ucryptolib), ensuring compatibility across all MicroPython platforms.\n")
+        report.append("""✅ **All tested platforms are compatible with NexLattice.**
+
+The code uses proper fallback mechanisms for optional dependencies (like ucryptolib), ensuring compatibility across all MicroPython platforms.
+""")
     else:
-        report.append("⚠️ **Some platforms may have limitations.**\n\n")
-        report.append("See detailed results above for platform-specific issues.\n")
+        report.append("""⚠️ **Some platforms may have limitations.**
+
+See detailed results above for platform-specific issues.
+""")
     
     return "".join(report)
 
@@ -332,8 +325,7 @@ if __name__ == '__main__':
     output_file = Path('compatibility/VIRTUAL_TEST_REPORT.md')
     output_file.parent.mkdir(exist_ok=True)
     
-    with open(output_file, 'w') as f:
-        f.write(report)
+    output_file.write_text(report, encoding='utf-8')
     
     print("=" * 70)
     print(f"✅ Test report saved to: {output_file}")
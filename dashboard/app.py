@@ -3,31 +3,136 @@ NexLattice Dashboard - Main Application
 Real-time visualization of mesh network status
 """
 
-from flask import Flask, render_template, request, jsonify
+# eventlet must patch the standard library before anything else is imported
+try:
+    import eventlet
+    eventlet.monkey_patch()
+    ASYNC_MODE = 'eventlet'
+except ImportError:
+    ASYNC_MODE = 'threading'
+
+from flask import Flask, Response, render_template, request
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 import json
+import heapq
 import time
+import zlib
+from collections import deque
 from datetime import datetime
+from itertools import islice
 import threading
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+def dumps_bytes(obj):
+    """Serialize obj to compact JSON bytes (orjson when installed)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+def json_response(obj):
+    """Build a JSON response without going through jsonify"""
+    return Response(dumps_bytes(obj), mimetype='application/json')
+
+
+class OrjsonCompat:
+    """json-module shim so Flask-SocketIO encodes packets with orjson"""
+    
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'nexlattice-secret-key'
+app.url_map.strict_slashes = False  # no redirects for trailing slashes
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE,
+                    json=OrjsonCompat if ORJSON_AVAILABLE else json)
 
 # Network state
 network_state = {
     'nodes': {},  # node_id: {info, stats, last_update}
-    'messages': [],  # Recent messages
+    'messages': deque(maxlen=100),  # Recent messages (oldest evicted first)
     'topology': {
         'nodes': [],
         'links': []
     }
 }
 
-# Lock for thread-safe updates
-state_lock = threading.Lock()
+# node_id -> time.monotonic() of the last update, used for timeout checks so
+# wall-clock jumps cannot mark nodes offline (last_update stays wall-clock for
+# clients; guarded by nodes_lock)
+last_seen = {}
+
+# (expiry, node_id, last_seen at push) per node update, earliest expiry first;
+# entries superseded by a newer update are skipped when popped (guarded by
+# nodes_lock)
+timeout_heap = []
+timeouts_armed = threading.Event()  # set when an entry is pushed
+
+# Locks for thread-safe updates, one per independently updated part of the
+# state so e.g. a send_message POST does not block node reads.
+# Lock order when nesting: nodes_lock before topology_lock.
+nodes_lock = threading.Lock()
+topology_lock = threading.Lock()
+messages_lock = threading.Lock()
+
+# Incrementally maintained topology, flattened into network_state['topology']
+# on demand by get_topology() (guarded by topology_lock)
+topology_index = {
+    'nodes': {},  # node_id: topology node entry
+    'links': {},  # link key: link entry
+    'link_owner': {},  # link key: node_id whose report is shown
+    'node_links': {},  # node_id: {link key: link entry as that node reports it}
+    'dirty': False
+}
+
+# Change counters, bumped under the matching lock (topology only changes
+# together with nodes)
+state_versions = {'nodes': 0, 'messages': 0}
+
+# Serialized bodies for the hot read endpoints:
+# key -> (versions, valid_until, body, etag)
+_response_cache = {}
+
+NODE_TIMEOUT = 120  # seconds without an update before a node counts as inactive
+
+# Node updates waiting for the next batched broadcast: node_id -> node info
+pending_updates = {}
+pending_lock = threading.Lock()
+updates_queued = threading.Event()  # set when pending_updates gains an entry
+BROADCAST_INTERVAL = 0.1  # seconds an update waits to be batched with others
+
+
+# CORS preflight answer for every route, sent before view dispatch and Flask-CORS
+PREFLIGHT_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Max-Age': '86400'
+}
+
+
+@app.before_request
+def answer_preflight():
+    """Answer OPTIONS requests with the fixed CORS headers"""
+    if request.method == 'OPTIONS':
+        response = Response(status=204, headers=PREFLIGHT_HEADERS)
+        requested_headers = request.headers.get('Access-Control-Request-Headers')
+        if requested_headers:
+            response.headers['Access-Control-Allow-Headers'] = requested_headers
+        return response
 
 
 @app.route('/')
@@ -36,16 +141,92 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/api/network_state')
+def _cached_json_response(key, parts, build):
+    """Serve a JSON body that is only rebuilt when the network state changes
+    
+    build() takes the locks it needs and returns (payload, valid_until); the
+    cached body is reused until the version of one of the state parts it
+    depends on changes or valid_until (a time.monotonic() value) passes.
+    """
+    version = tuple(state_versions[part] for part in parts)
+    cached = _response_cache.get(key)
+    if cached and cached[0] == version and time.monotonic() < cached[1]:
+        return _send_cached_body(cached[2], cached[3])
+    
+    payload, valid_until = build()
+    
+    body = dumps_bytes(payload)
+    etag = f"{key}-{zlib.crc32(body):08x}"
+    _response_cache[key] = (version, valid_until, body, etag)
+    return _send_cached_body(body, etag)
+
+
+def _send_cached_body(body, etag):
+    """Send a pre-encoded JSON body, answering a matching If-None-Match with 304"""
+    response = Response(body, mimetype='application/json', direct_passthrough=True)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # always revalidate
+    return response.make_conditional(request)
+
+
+@app.route('/api/network_state', methods=['GET'], provide_automatic_options=False)
 def get_network_state():
     """Get current network state"""
-    with state_lock:
-        return jsonify({
-            'nodes': list(network_state['nodes'].values()),
-            'topology': network_state['topology'],
-            'messages': network_state['messages'][-50:],  # Last 50 messages
+    def build():
+        with nodes_lock:
+            nodes = list(network_state['nodes'].values())
+        with topology_lock:
+            topology = get_topology()
+        with messages_lock:
+            messages = recent_messages()
+        
+        return {
+            'nodes': nodes,
+            'topology': topology,
+            'messages': messages,
             'timestamp': time.time()
-        })
+        }, float('inf')
+    
+    return _cached_json_response('network_state', ('nodes', 'messages'), build)
+
+
+def _record_node_update(data):
+    """Store one node's status report; caller holds nodes_lock"""
+    node_id = data['node_id']
+    
+    # Nodes report only the stats that changed since their last update
+    previous = network_state['nodes'].get(node_id)
+    stats = dict(previous['stats']) if previous else {}
+    stats.update(data.get('stats', {}))
+    
+    # Update node info
+    node_info = {
+        'node_id': node_id,
+        'node_name': data.get('node_name'),
+        'peers': data.get('peers', []),
+        'stats': stats,
+        'last_update': time.time(),
+        'status': 'online'
+    }
+    network_state['nodes'][node_id] = node_info
+    seen = time.monotonic()
+    last_seen[node_id] = seen
+    heapq.heappush(timeout_heap, (seen + NODE_TIMEOUT, node_id, seen))
+    
+    # Update topology
+    with topology_lock:
+        update_topology(node_id)
+    
+    return dict(node_info)
+
+
+def _queue_node_updates(payloads):
+    """Queue node payloads for the next batched broadcast"""
+    # Later updates from the same node replace earlier ones
+    with pending_lock:
+        for payload in payloads:
+            pending_updates[payload['node_id']] = payload
+    updates_queued.set()
 
 
 @app.route('/api/update_node', methods=['POST'])
@@ -55,38 +236,51 @@ def update_node():
         data = request.get_json()
         
         if not data:
-            return jsonify({'error': 'No data provided'}), 400
+            return json_response({'error': 'No data provided'}), 400
         
         node_id = data.get('node_id')
         if not node_id:
-            return jsonify({'error': 'No node_id provided'}), 400
+            return json_response({'error': 'No node_id provided'}), 400
         
-        with state_lock:
-            # Update node info
-            network_state['nodes'][node_id] = {
-                'node_id': node_id,
-                'node_name': data.get('node_name'),
-                'peers': data.get('peers', []),
-                'stats': data.get('stats', {}),
-                'last_update': time.time(),
-                'status': 'online'
-            }
-            
-            # Update topology
-            update_topology()
+        with nodes_lock:
+            state_versions['nodes'] += 1
+            payload = _record_node_update(data)
+        timeouts_armed.set()
         
-        # Broadcast update to all connected clients
-        socketio.emit('node_update', {
-            'node_id': node_id,
-            'data': network_state['nodes'][node_id],
-            'topology': network_state['topology']
-        })
+        _queue_node_updates((payload,))
         
-        return jsonify({'success': True})
+        return json_response({'success': True})
         
     except Exception as e:
         print(f"Error updating node: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}), 500
+
+
+@app.route('/api/update_nodes', methods=['POST'])
+def update_nodes():
+    """Receive status updates for several nodes in one request"""
+    try:
+        data = request.get_json()
+        
+        if not data or not isinstance(data.get('nodes'), list):
+            return json_response({'error': 'No nodes provided'}), 400
+        
+        reports = [node for node in data['nodes'] if isinstance(node, dict) and node.get('node_id')]
+        if len(reports) != len(data['nodes']):
+            return json_response({'error': 'Every node needs a node_id'}), 400
+        
+        with nodes_lock:
+            state_versions['nodes'] += 1
+            payloads = [_record_node_update(node) for node in reports]
+        timeouts_armed.set()
+        
+        _queue_node_updates(payloads)
+        
+        return json_response({'success': True, 'updated': len(payloads)})
+        
+    except Exception as e:
+        print(f"Error updating nodes: {e}")
+        return json_response({'error': str(e)}), 500
 
 
 @app.route('/api/send_message', methods=['POST'])
@@ -99,7 +293,7 @@ def send_message():
         message = data.get('message')
         
         if not all([source, destination, message]):
-            return jsonify({'error': 'Missing required fields'}), 400
+            return json_response({'error': 'Missing required fields'}), 400
         
         # Log message
         message_entry = {
@@ -111,128 +305,233 @@ def send_message():
             'status': 'sent'
         }
         
-        with state_lock:
+        with messages_lock:
+            state_versions['messages'] += 1
             network_state['messages'].append(message_entry)
-            # Keep only last 100 messages
-            if len(network_state['messages']) > 100:
-                network_state['messages'] = network_state['messages'][-100:]
         
         # Broadcast to clients
         socketio.emit('new_message', message_entry)
         
-        return jsonify({'success': True, 'message_id': message_entry['id']})
+        return json_response({'success': True, 'message_id': message_entry['id']})
         
     except Exception as e:
         print(f"Error sending message: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}), 500
 
 
-@app.route('/api/nodes')
+@app.route('/api/nodes', methods=['GET'], provide_automatic_options=False)
 def get_nodes():
     """Get list of all nodes"""
-    with state_lock:
-        nodes = list(network_state['nodes'].values())
-    return jsonify({'nodes': nodes})
+    def build():
+        with nodes_lock:
+            nodes = list(network_state['nodes'].values())
+        return {'nodes': nodes}, float('inf')
+    
+    return _cached_json_response('nodes', ('nodes',), build)
 
 
 @app.route('/api/node/<node_id>')
 def get_node_details(node_id):
     """Get detailed information about specific node"""
-    with state_lock:
+    with nodes_lock:
         node = network_state['nodes'].get(node_id)
     
     if node:
-        return jsonify(node)
+        return json_response(node)
     else:
-        return jsonify({'error': 'Node not found'}), 404
+        return json_response({'error': 'Node not found'}), 404
 
 
-@app.route('/api/stats')
+@app.route('/api/stats', methods=['GET'], provide_automatic_options=False)
 def get_stats():
     """Get overall network statistics"""
-    with state_lock:
-        total_nodes = len(network_state['nodes'])
-        active_nodes = sum(1 for n in network_state['nodes'].values() 
-                          if time.time() - n['last_update'] < 120)
-        total_links = len(network_state['topology']['links'])
-        total_messages = len(network_state['messages'])
+    def build():
+        # Snapshot under the locks, aggregate outside them
+        with nodes_lock:
+            nodes = [(n['stats'], last_seen[node_id])
+                     for node_id, n in network_state['nodes'].items()]
+        with topology_lock:
+            total_links = len(topology_index['links'])
+        with messages_lock:
+            total_messages = len(network_state['messages'])
+        
+        now = time.monotonic()
         
-        # Calculate total stats
-        total_sent = sum(n['stats'].get('messages_sent', 0) 
-                        for n in network_state['nodes'].values())
-        total_received = sum(n['stats'].get('messages_received', 0) 
-                            for n in network_state['nodes'].values())
-        total_forwarded = sum(n['stats'].get('messages_forwarded', 0) 
-                             for n in network_state['nodes'].values())
+        # One pass for all totals. active_nodes changes as nodes age out, so
+        # the cached body is only valid until the oldest active node crosses
+        # the timeout
+        active = total_sent = total_received = total_forwarded = 0
+        oldest_active = float('inf')
+        for stats, seen in nodes:
+            if now - seen < NODE_TIMEOUT:
+                active += 1
+                if seen < oldest_active:
+                    oldest_active = seen
+            total_sent += stats.get('messages_sent', 0)
+            total_received += stats.get('messages_received', 0)
+            total_forwarded += stats.get('messages_forwarded', 0)
+        valid_until = oldest_active + NODE_TIMEOUT
+        
+        return {
+            'total_nodes': len(nodes),
+            'active_nodes': active,
+            'total_links': total_links,
+            'total_messages': total_messages,
+            'messages_sent': total_sent,
+            'messages_received': total_received,
+            'messages_forwarded': total_forwarded,
+            'timestamp': time.time()
+        }, valid_until
     
-    return jsonify({
-        'total_nodes': total_nodes,
-        'active_nodes': active_nodes,
-        'total_links': total_links,
-        'total_messages': total_messages,
-        'messages_sent': total_sent,
-        'messages_received': total_received,
-        'messages_forwarded': total_forwarded,
-        'timestamp': time.time()
-    })
+    return _cached_json_response('stats', ('nodes', 'messages'), build)
+
+
+def recent_messages(count=50):
+    """Return the last `count` messages as a list (call with messages_lock held)"""
+    messages = network_state['messages']
+    return list(islice(messages, max(0, len(messages) - count), None))
 
 
-def update_topology():
-    """Update network topology from node peer information"""
-    nodes_list = []
-    links_list = []
-    link_set = set()  # To avoid duplicates
+def update_topology(node_id):
+    """Apply one node's peer report to the topology
     
-    for node_id, node_info in network_state['nodes'].items():
-        # Add node
-        nodes_list.append({
-            'id': node_id,
-            'name': node_info['node_name'],
-            'status': node_info['status'],
-            'peers': len(node_info.get('peers', [])),
-            'uptime': node_info['stats'].get('uptime', 0)
-        })
-        
-        # Add links to peers
-        for peer in node_info.get('peers', []):
-            peer_id = peer.get('id')
-            if peer_id:
-                # Create link (ensure no duplicates)
-                link_key = tuple(sorted([node_id, peer_id]))
-                if link_key not in link_set:
-                    link_set.add(link_key)
-                    links_list.append({
-                        'source': node_id,
-                        'target': peer_id,
-                        'latency': peer.get('latency'),
-                        'status': 'active' if peer.get('connected') else 'inactive'
-                    })
+    Only the changed node's links are diffed against its previous report,
+    instead of rebuilding every node and link. Call with nodes_lock and
+    topology_lock held.
+    """
+    node_info = network_state['nodes'][node_id]
+    peers = node_info.get('peers', [])
+    links = topology_index['links']
+    link_owner = topology_index['link_owner']
     
-    network_state['topology'] = {
-        'nodes': nodes_list,
-        'links': links_list
+    # Add/refresh node
+    topology_index['nodes'][node_id] = {
+        'id': node_id,
+        'name': node_info['node_name'],
+        'status': node_info['status'],
+        'peers': len(peers),
+        'uptime': node_info['stats'].get('uptime', 0)
     }
+    
+    # Links as reported by this node, keyed by the ordered endpoint pair
+    # (ensure no duplicates)
+    reported = {}
+    for peer in peers:
+        peer_id = peer.get('id')
+        if peer_id:
+            key = (node_id, peer_id) if node_id < peer_id else (peer_id, node_id)
+            if key not in reported:
+                reported[key] = {
+                    'source': node_id,
+                    'target': peer_id,
+                    'latency': peer.get('latency'),
+                    'status': 'active' if peer.get('connected') else 'inactive'
+                }
+    
+    previous = topology_index['node_links'].get(node_id, {})
+    topology_index['node_links'][node_id] = reported
+    
+    # Links this node no longer reports go away, unless the other end still
+    # reports them, in which case that report takes over
+    for key in previous.keys() - reported.keys():
+        if link_owner.get(key) != node_id:
+            continue
+        other_id = key[1] if key[0] == node_id else key[0]
+        other_link = topology_index['node_links'].get(other_id, {}).get(key)
+        if other_link:
+            links[key] = other_link
+            link_owner[key] = other_id
+        else:
+            del links[key]
+            del link_owner[key]
+    
+    # A link is shown as reported by the first node that reported it
+    for key, link in reported.items():
+        if link_owner.setdefault(key, node_id) == node_id:
+            links[key] = link
+    
+    topology_index['dirty'] = True
+
+
+def get_topology():
+    """Return the flat topology, rebuilding the lists only after a change
+    
+    Call with topology_lock held.
+    """
+    if topology_index['dirty']:
+        network_state['topology'] = {
+            'nodes': list(topology_index['nodes'].values()),
+            'links': list(topology_index['links'].values())
+        }
+        topology_index['dirty'] = False
+    return network_state['topology']
+
+
+def flush_node_updates():
+    """Background task broadcasting queued node updates as one event"""
+    while True:
+        # Idle until an update arrives, then give others a moment to join it
+        updates_queued.wait()
+        updates_queued.clear()
+        socketio.sleep(BROADCAST_INTERVAL)
+        
+        with pending_lock:
+            if not pending_updates:
+                continue
+            updates = dict(pending_updates)
+            pending_updates.clear()
+        
+        with topology_lock:
+            topology = get_topology()
+        
+        # One topology per batch instead of one per POST
+        socketio.emit('node_updates_batch', {
+            'updates': updates,
+            'topology': topology
+        })
 
 
 def check_node_timeouts():
-    """Background task to check for inactive nodes"""
+    """Background task marking nodes offline as their timeouts expire
+    
+    Sleeps until the earliest pending expiry instead of polling every node.
+    """
     while True:
-        time.sleep(30)  # Check every 30 seconds
+        timeouts_armed.clear()
+        current_time = time.monotonic()
         
-        current_time = time.time()
-        timeout = 120  # 2 minutes
+        offline_ids = []
+        with nodes_lock:
+            while timeout_heap and timeout_heap[0][0] <= current_time:
+                _, node_id, seen = heapq.heappop(timeout_heap)
+                if last_seen[node_id] != seen:
+                    continue  # Node updated since; a later entry covers it
+                node_info = network_state['nodes'][node_id]
+                if node_info['status'] != 'offline':
+                    node_info['status'] = 'offline'
+                    state_versions['nodes'] += 1
+                    offline_ids.append(node_id)
+            
+            next_expiry = timeout_heap[0][0] if timeout_heap else None
+            
+            if offline_ids:
+                with topology_lock:
+                    for node_id in offline_ids:
+                        topology_index['nodes'][node_id]['status'] = 'offline'
+                    topology_index['dirty'] = True
         
-        with state_lock:
-            for node_id, node_info in network_state['nodes'].items():
-                if current_time - node_info['last_update'] > timeout:
-                    if node_info['status'] != 'offline':
-                        node_info['status'] = 'offline'
-                        
-                        # Notify clients
-                        socketio.emit('node_status', {
-                            'node_id': node_id,
-                            'status': 'offline'
-                        })
+        # Notify clients once the lock is released
+        for node_id in offline_ids:
+            socketio.emit('node_status', {
+                'node_id': node_id,
+                'status': 'offline'
+            })
+        
+        if next_expiry is None:
+            # Nothing to expire: sleep until the next node update arms a timeout
+            timeouts_armed.wait()
+        else:
+            socketio.sleep(max(next_expiry - time.monotonic(), 0))
 
 
 @socketio.on('connect')
@@ -241,12 +540,18 @@ def handle_connect():
     print(f"Client connected: {request.sid}")
     
     # Send current state to new client
-    with state_lock:
-        emit('initial_state', {
-            'nodes': list(network_state['nodes'].values()),
-            'topology': network_state['topology'],
-            'messages': network_state['messages'][-50:]
-        })
+    with nodes_lock:
+        nodes = list(network_state['nodes'].values())
+    with topology_lock:
+        topology = get_topology()
+    with messages_lock:
+        messages = recent_messages()
+    
+    emit('initial_state', {
+        'nodes': nodes,
+        'topology': topology,
+        'messages': messages
+    })
 
 
 @socketio.on('disconnect')
@@ -258,11 +563,13 @@ def handle_disconnect():
 @socketio.on('request_update')
 def handle_update_request():
     """Handle manual update request from client"""
-    with state_lock:
-        emit('node_update', {
-            'topology': network_state['topology'],
-            'timestamp': time.time()
-        })
+    with topology_lock:
+        topology = get_topology()
+    
+    emit('node_update', {
+        'topology': topology,
+        'timestamp': time.time()
+    })
 
 
 def init_app():
@@ -270,9 +577,9 @@ def init_app():
     print("🚀 NexLattice Dashboard Starting...")
     print("=" * 50)
     
-    # Start background thread for timeout checking
-    timeout_thread = threading.Thread(target=check_node_timeouts, daemon=True)
-    timeout_thread.start()
+    # Start background tasks for timeout checking and update broadcasts
+    socketio.start_background_task(check_node_timeouts)
+    socketio.start_background_task(flush_node_updates)
     
     print("✅ Dashboard initialized")
     print("📊 Access dashboard at: http://localhost:8080")
@@ -46,6 +46,14 @@ function setupSocketHandlers() {
         fetchStats();
     });
 
+    socket.on('node_updates_batch', (data) => {
+        console.log('🔄 Node updates received', Object.keys(data.updates));
+        if (data.topology) {
+            updateNetworkData({ topology: data.topology });
+        }
+        fetchStats();
+    });
+
     socket.on('node_status', (data) => {
         console.log('⚠️  Node status change', data);
         updateNodeStatus(data.node_id, data.status);
@@ -8,6 +8,7 @@ import uhashlib
 import urandom
 import json
 import time
+from collections import OrderedDict
 
 try:
     import ucryptolib
@@ -16,6 +17,15 @@ except ImportError:
     CRYPTO_AVAILABLE = False
     print("⚠️  ucryptolib not available, using basic encryption")
 
+try:
+    import hmac
+    HMAC_AVAILABLE = True
+except ImportError:
+    HMAC_AVAILABLE = False
+
+# PKCS7 pad strings indexed by pad length (1-16)
+_PKCS7_PADS = tuple(bytes([i] * i) for i in range(17))
+
 
 class CryptoManager:
     def __init__(self, node_id, psk=None):
@@ -41,9 +51,20 @@ class CryptoManager:
             # Default PSK - should be changed in production
             self.psk = b'NexLatticeSharedSecretKey256'  # 32 bytes for AES-256
         
+        # AES-128 keys (first 16 bytes), sliced once instead of per packet
+        self._psk16 = self.psk[:16]
+        self._session_keys16 = {}  # peer_id: shared_key[:16]
+        
+        # HMAC-SHA256 inner/outer key pads, used when the hmac module is missing
+        key = self.psk if len(self.psk) <= 64 else uhashlib.sha256(self.psk).digest()
+        key = key + b'\x00' * (64 - len(key))
+        self._hmac_ipad = bytes(b ^ 0x36 for b in key)
+        self._hmac_opad = bytes(b ^ 0x5c for b in key)
+        
         # Challenge cache for authentication
-        self.challenge_cache = {}  # peer_id: {challenge, timestamp}
+        self.challenge_cache = OrderedDict()  # peer_id: {challenge, timestamp}, oldest first
         self.challenge_ttl = 30  # seconds
+        self.max_challenges = 64  # bound for peers that never respond
         
         print(f"🔐 Crypto initialized for {node_id}")
     
@@ -76,6 +97,7 @@ class CryptoManager:
             shared_key = uhashlib.sha256(secret_bytes).digest()
             
             self.session_keys[peer_id] = shared_key
+            self._session_keys16[peer_id] = shared_key[:16]
             print(f"🔐 secure session established with {peer_id} via Diffie-Hellman")
             return True
         except Exception as e:
@@ -84,16 +106,25 @@ class CryptoManager:
     
     def encrypt(self, plaintext, peer_id=None):
         """Encrypt data for transmission"""
+        # Convert string to bytes
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode()
+        
+        # Return IV + ciphertext as base64 (4/3 expansion vs hex's 2x)
+        return ubinascii.b2a_base64(self._encrypt_bytes(plaintext, peer_id)).rstrip().decode()
+    
+    def decrypt(self, ciphertext, peer_id=None):
+        """Decrypt received data"""
+        return self._decrypt_bytes(ubinascii.a2b_base64(ciphertext), peer_id).decode()
+    
+    def _encrypt_bytes(self, plaintext, peer_id=None):
+        """Encrypt bytes to raw IV + ciphertext"""
         if not CRYPTO_AVAILABLE:
-            return self._simple_encrypt(plaintext)
+            return self._xor_psk(plaintext)
         
         try:
             # Use session key if available, otherwise PSK
-            key = self.session_keys.get(peer_id, self.psk)
-            
-            # Convert string to bytes
-            if isinstance(plaintext, str):
-                plaintext = plaintext.encode()
+            key = self._session_keys16.get(peer_id, self._psk16)
             
             # Pad to 16-byte boundary for AES
             padded = self._pad(plaintext)
@@ -102,85 +133,57 @@ class CryptoManager:
             iv = urandom.getrandbits(128).to_bytes(16, 'big')
             
             # Encrypt with AES-CBC
-            cipher = ucryptolib.aes(key[:16], 2, iv)  # Mode 2 = CBC
-            ciphertext = cipher.encrypt(padded)
-            
-            # Return IV + ciphertext as hex
-            encrypted = ubinascii.hexlify(iv + ciphertext).decode()
-            return encrypted
+            cipher = ucryptolib.aes(key, 2, iv)  # Mode 2 = CBC
+            return iv + cipher.encrypt(padded)
             
         except Exception as e:
             print(f"❌ Encryption error: {e}")
-            return self._simple_encrypt(plaintext)
+            return self._xor_psk(plaintext)
     
-    def decrypt(self, ciphertext, peer_id=None):
-        """Decrypt received data"""
+    def _decrypt_bytes(self, encrypted_data, peer_id=None):
+        """Decrypt raw IV + ciphertext to bytes"""
         if not CRYPTO_AVAILABLE:
-            return self._simple_decrypt(ciphertext)
+            return self._xor_psk(encrypted_data)
         
         try:
             # Use session key if available, otherwise PSK
-            key = self.session_keys.get(peer_id, self.psk)
-            
-            # Decode from hex
-            encrypted_data = ubinascii.unhexlify(ciphertext)
+            key = self._session_keys16.get(peer_id, self._psk16)
             
             # Extract IV and ciphertext
             iv = encrypted_data[:16]
             ciphertext_bytes = encrypted_data[16:]
             
             # Decrypt with AES-CBC
-            cipher = ucryptolib.aes(key[:16], 2, iv)
+            cipher = ucryptolib.aes(key, 2, iv)
             plaintext = cipher.decrypt(ciphertext_bytes)
             
             # Remove padding
-            unpadded = self._unpad(plaintext)
-            
-            return unpadded.decode()
+            return self._unpad(plaintext)
             
         except Exception as e:
             print(f"❌ Decryption error: {e}")
-            return self._simple_decrypt(ciphertext)
+            return self._xor_psk(encrypted_data)
     
     def _pad(self, data):
         """PKCS7 padding"""
-        pad_len = 16 - (len(data) % 16)
-        return data + bytes([pad_len] * pad_len)
+        return data + _PKCS7_PADS[16 - (len(data) % 16)]
     
     def _unpad(self, data):
         """Remove PKCS7 padding"""
         pad_len = data[-1]
         return data[:-pad_len]
     
-    def _simple_encrypt(self, plaintext):
-        """Simple XOR encryption as fallback"""
-        if isinstance(plaintext, str):
-            plaintext = plaintext.encode()
-        
-        key = self.psk[:len(plaintext)]
-        encrypted = bytes(a ^ b for a, b in zip(plaintext, key * (len(plaintext) // len(key) + 1)))
-        return ubinascii.hexlify(encrypted).decode()
-    
-    def _simple_decrypt(self, ciphertext):
-        """Simple XOR decryption as fallback"""
-        encrypted = ubinascii.unhexlify(ciphertext)
-        key = self.psk[:len(encrypted)]
-        decrypted = bytes(a ^ b for a, b in zip(encrypted, key * (len(encrypted) // len(key) + 1)))
-        return decrypted.decode()
+    def _xor_psk(self, data):
+        """Simple XOR encryption with the PSK repeated to the data length (fallback)"""
+        # One bignum XOR instead of a per-byte generator
+        size = len(data)
+        keystream = (self.psk * (size // len(self.psk) + 1))[:size]
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(size, 'big')
     
     def sign_message(self, message):
         """Create message signature (HMAC-SHA256) using PSK"""
-        if isinstance(message, dict):
-            msg_copy = message.copy()
-            msg_copy.pop('signature', None)
-            message_str = json.dumps(msg_copy, sort_keys=True)
-        elif isinstance(message, str):
-            message_str = message
-        else:
-            message_str = str(message)
-        
-        # HMAC-style signing using PSK
-        signature = uhashlib.sha256(message_str.encode() + self.psk).hexdigest()
+        # HMAC-SHA256 signing using PSK
+        signature = self._hmac_sha256(self._signing_payload(message))
         return signature
     
     def verify_signature(self, message, signature, peer_id=None):
@@ -188,28 +191,52 @@ class CryptoManager:
         if not signature or len(signature) != 64:  # SHA256 hex length
             return False
         
-        if isinstance(message, dict):
-            # Create a copy and remove signature if present to match signing state
-            msg_copy = message.copy()
-            msg_copy.pop('signature', None)
-            message_str = json.dumps(msg_copy, sort_keys=True)
-        elif isinstance(message, str):
-            message_str = message
-        else:
-            message_str = str(message)
-        
-        expected_sig = uhashlib.sha256(message_str.encode() + self.psk).hexdigest()
+        expected_sig = self._hmac_sha256(self._signing_payload(message))
         
         # Constant-time comparison to prevent timing attacks
         return self._constant_time_compare(signature, expected_sig)
     
+    def _signing_payload(self, message):
+        """Bytes that get signed for a message; only dicts are re-serialized"""
+        if isinstance(message, (bytes, bytearray)):
+            return message
+        if isinstance(message, str):
+            return message.encode()
+        if isinstance(message, dict):
+            # Sign a copy without the signature field so signing and
+            # verification see the same content
+            msg_copy = message.copy()
+            msg_copy.pop('signature', None)
+            return json.dumps(msg_copy, sort_keys=True).encode()
+        return str(message).encode()
+    
+    def _hmac_sha256(self, data):
+        """HMAC-SHA256 of data keyed with the PSK, as a hex string"""
+        return ubinascii.hexlify(self._hmac_digest(data)).decode()
+    
+    def _hmac_digest(self, data):
+        """HMAC-SHA256 of data keyed with the PSK, as raw bytes"""
+        if HMAC_AVAILABLE:
+            return hmac.new(self.psk, data, 'sha256').digest()
+        inner = uhashlib.sha256(self._hmac_ipad + data).digest()
+        return uhashlib.sha256(self._hmac_opad + inner).digest()
+    
     def _constant_time_compare(self, a, b):
-        """Constant-time string comparison"""
+        """Constant-time comparison of two strings or byte strings; False for anything else"""
+        # Peer-supplied values may be non-ASCII or not strings at all
+        if not isinstance(a, (str, bytes)) or not isinstance(b, (str, bytes)):
+            return False
+        if isinstance(a, str):
+            a = a.encode()
+        if isinstance(b, str):
+            b = b.encode()
+        if HMAC_AVAILABLE:
+            return hmac.compare_digest(a, b)
         if len(a) != len(b):
             return False
         result = 0
         for x, y in zip(a, b):
-            result |= ord(x) ^ ord(y)
+            result |= x ^ y
         return result == 0
     
     def generate_session_token(self):
@@ -221,10 +248,25 @@ class CryptoManager:
         # Create random challenge
         challenge = ubinascii.hexlify(urandom.getrandbits(128).to_bytes(16, 'big')).decode()
         
+        # Drop expired challenges; entries are in issue order, so stop at the
+        # first one still live
+        now = time.time()
+        cache = self.challenge_cache
+        while cache:
+            oldest = next(iter(cache))
+            if now - cache[oldest]['timestamp'] <= self.challenge_ttl:
+                break
+            del cache[oldest]
+        
+        # Re-issuing moves the peer to the newest end; evict the oldest at the cap
+        cache.pop(peer_id, None)
+        if len(cache) >= self.max_challenges:
+            del cache[next(iter(cache))]
+        
         # Store challenge with timestamp
-        self.challenge_cache[peer_id] = {
+        cache[peer_id] = {
             'challenge': challenge,
-            'timestamp': time.time()
+            'timestamp': now
         }
         
         return challenge
@@ -243,10 +285,8 @@ class CryptoManager:
         
         challenge = challenge_data['challenge']
         
-        # Expected response: HMAC(challenge + PSK)
-        expected_response = uhashlib.sha256(
-            challenge.encode() + self.psk
-        ).hexdigest()
+        # Expected response: HMAC(PSK, challenge)
+        expected_response = self._hmac_sha256(challenge.encode())
         
         # Verify response
         is_valid = self._constant_time_compare(response, expected_response)
@@ -259,40 +299,36 @@ class CryptoManager:
     
     def compute_challenge_response(self, challenge):
         """Compute response to authentication challenge"""
-        # Response: HMAC(challenge + PSK)
-        response = uhashlib.sha256(challenge.encode() + self.psk).hexdigest()
+        # Response: HMAC(PSK, challenge)
+        response = self._hmac_sha256(challenge.encode())
         return response
     
     def sign_and_encrypt(self, message, peer_id):
-        """Sign and encrypt message (mandatory signing)"""
-        # First, sign the message
-        signature = self.sign_message(message)
-        message['signature'] = signature
+        """Sign and encrypt message (mandatory signing)
         
-        # Convert to JSON string for encryption
-        message_json = json.dumps(message)
+        The envelope is the raw 32-byte HMAC followed by the JSON body, so the
+        signature covers the exact bytes sent and is never re-serialized.
+        """
+        body = json.dumps(message).encode()
         
         # Encrypt the signed message
-        encrypted = self.encrypt(message_json, peer_id)
+        encrypted = self._encrypt_bytes(self._hmac_digest(body) + body, peer_id)
         
-        return encrypted
+        return ubinascii.b2a_base64(encrypted).rstrip().decode()
     
     def decrypt_and_verify(self, ciphertext, peer_id):
         """Decrypt and verify message signature (mandatory verification)"""
         # Decrypt first
-        message_json = self.decrypt(ciphertext, peer_id)
+        envelope = self._decrypt_bytes(ubinascii.a2b_base64(ciphertext), peer_id)
         
-        # Parse JSON
-        message = json.loads(message_json)
-        
-        # Extract signature
-        signature = message.pop('signature', None)
-        if not signature:
+        # Split signature and body
+        signature = envelope[:32]
+        body = envelope[32:]
+        if len(signature) != 32:
             raise ValueError("Message missing signature")
         
         # Verify signature
-        if not self.verify_signature(message, signature, peer_id):
+        if not self._constant_time_compare(signature, self._hmac_digest(body)):
             raise ValueError("Invalid message signature")
         
-        return message
-
+        return json.loads(body.decode())
@@ -5,6 +5,70 @@ Implements dynamic Ad-Hoc On-Demand Distance Vector (AODV) routing for the mesh
 
 import time
 import json
+import heapq
+import ubinascii
+import urandom
+from array import array
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings for duplicate detection"""
+    
+    def __init__(self, size_bits=16384, k=3):
+        """Initialize an empty filter; size_bits must be a power of two"""
+        self.mask = size_bits - 1
+        self.k = k
+        self.bits = bytearray(size_bits // 8)
+        self.count = 0
+    
+    def _positions(self, item):
+        """Bit positions for item (double hashing over two CRC32 seeds)"""
+        data = item.encode()
+        h1 = ubinascii.crc32(data)
+        h2 = ubinascii.crc32(data, 0x9e3779b9) | 1
+        return [(h1 + i * h2) & self.mask for i in range(self.k)]
+    
+    def add(self, item):
+        """Add item to the filter"""
+        bits = self.bits
+        for pos in self._positions(item):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+    
+    def __contains__(self, item):
+        """Check membership (may return false positives, never false negatives)"""
+        bits = self.bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+    
+    def clear(self):
+        """Reset the filter"""
+        self.bits = bytearray(len(self.bits))
+        self.count = 0
+
+
+class InverseBloomFilter:
+    """Fixed-size table of recent item hashes; may forget items, false positives only on CRC32 collisions"""
+    
+    def __init__(self, size=512):
+        """Initialize an empty table of size slots (size must be even)"""
+        if size & 1:
+            raise ValueError('InverseBloomFilter size must be even')
+        self.size = size
+        self.table = array('I', bytearray(4 * size))
+    
+    def check_and_set(self, item):
+        """Record item; returns True if it was the last item stored in its slot"""
+        # The slot index carries bit 0 of the CRC (size is even), so the
+        # stored value sets it to keep 0 free to mean an empty slot
+        crc = ubinascii.crc32(item.encode())
+        idx = crc % self.size
+        stored = crc | 1
+        seen = self.table[idx] == stored
+        self.table[idx] = stored
+        return seen
 
 
 class MessageRouter:
@@ -17,19 +81,32 @@ class MessageRouter:
         # Routing table: destination_id -> {next_hop, hop_distance, active, updated}
         self.routing_table = {}
         
-        # Message cache for loop prevention
-        self.message_cache = {}  # message_id -> timestamp
+        # Message cache for loop prevention: two Bloom filters (4 KB total)
+        # rotated every cache_ttl, so an ID is remembered for 1-2 TTLs
+        self.message_cache = BloomFilter()
+        self.previous_message_cache = BloomFilter()
         self.cache_ttl = 60  # seconds
+        self.cache_rotated = time.time()
+        # Exact check for the most recent IDs, consulted before the filters
+        self.recent_messages = InverseBloomFilter()
         
         # AODV buffers and parameters
         self.message_buffer = {}  # dest_id -> list of messages waiting for route
         self.rreq_seq_num = 0
-        self.seen_rreqs = {}  # (source_id, rreq_id) -> timestamp
+        self.seen_rreqs = {}  # (source_id, rreq_id) -> [timestamp, times heard]
+        self.seen_rreq_heap = []  # (timestamp, rreq key) min-heap for expiring seen_rreqs
         self.max_hops = 5
         
+        # Counter-based RREQ rebroadcast: wait a random delay, then skip the
+        # rebroadcast if enough neighbours already covered the area
+        self.pending_rreqs = {}  # (source_id, rreq_id) -> (due time, rreq)
+        self.rreq_jitter = 0.1  # seconds, max random rebroadcast delay
+        self.rreq_counter_threshold = 3  # copies heard that cancel a rebroadcast
+        self.rreq_forward_probability = 0.65  # once a duplicate was heard
+        
         print(f"🗺️  Dynamic AODV Router initialized for {node_id}")
     
-    def route_message(self, message):
+    def route_message(self, message, message_json=None):
         """Route a message to its destination using AODV routing"""
         dest_id = message.get('destination')
         
@@ -37,7 +114,7 @@ class MessageRouter:
         peer = self.network.get_peer(dest_id)
         if peer and peer.get('connected'):
             # Send directly
-            return self._send_message(message, peer['ip'])
+            return self._send_message(message_json or message, peer['ip'])
         
         # Find active route in our routing table
         route = self.routing_table.get(dest_id)
@@ -46,7 +123,7 @@ class MessageRouter:
             next_hop_peer = self.network.get_peer(next_hop)
             if next_hop_peer and next_hop_peer.get('connected'):
                 # Forward to next hop
-                return self._send_message(message, next_hop_peer['ip'])
+                return self._send_message(message_json or message, next_hop_peer['ip'])
             else:
                 # Route is broken
                 route['active'] = False
@@ -58,12 +135,15 @@ class MessageRouter:
         self.send_rreq(dest_id)
         return True
     
-    def forward_message(self, message):
+    def forward_message(self, message, raw=None):
         """Forward a received message to its destination"""
+        has_msg_id = 'msg_id' in message
         msg_id = message.get('msg_id', f"{message['source']}_{message['timestamp']}")
         
         # Check if we've seen this message (loop prevention)
-        if msg_id in self.message_cache:
+        self._cleanup_cache()
+        if (self.recent_messages.check_and_set(msg_id) or
+                msg_id in self.message_cache or msg_id in self.previous_message_cache):
             print(f"🔄 Message loop detected, dropping {msg_id}")
             return False
         
@@ -78,11 +158,32 @@ class MessageRouter:
         message['msg_id'] = msg_id
         
         # Cache message
-        self.message_cache[msg_id] = time.time()
-        self._cleanup_cache()
+        self.message_cache.add(msg_id)
+        
+        # Patch the received JSON rather than re-encoding the whole message
+        message_json = None
+        if raw:
+            message_json = self._rewrite_forward_header(raw, hop_count, msg_id, has_msg_id)
         
         # Route the message using our AODV router
-        return self.route_message(message)
+        return self.route_message(message, message_json)
+    
+    def _rewrite_forward_header(self, raw, hop_count, msg_id, has_msg_id):
+        """Bump hop_count (and add msg_id) in received JSON text; None if it can't be done safely"""
+        field = '"hop_count": ' + str(hop_count)
+        start = raw.find(field)
+        end = start + len(field)
+        # The field must be unambiguous and match the parsed value exactly
+        if (start < 0 or raw[end:end + 1] not in (',', '}') or
+                raw.find('"hop_count": ', end) >= 0 or raw.find('"hop_count": ', 0, start) >= 0):
+            return None
+        
+        raw = raw[:start] + '"hop_count": ' + str(hop_count + 1) + raw[end:]
+        if not has_msg_id:
+            if raw[:1] != '{':
+                return None
+            raw = '{"msg_id": ' + json.dumps(msg_id) + ', ' + raw[1:]
+        return raw
     
     def buffer_message(self, dest_id, message):
         """Buffer a message waiting for route discovery"""
@@ -130,21 +231,21 @@ class MessageRouter:
             return False
         
         # Check if we have already seen this RREQ
+        self._expire_seen_rreqs()
         rreq_key = (source, rreq_id)
         if rreq_key in self.seen_rreqs:
+            self.seen_rreqs[rreq_key][1] += 1
             return False
         
         # Record this RREQ as seen
-        self.seen_rreqs[rreq_key] = time.time()
+        seen_time = time.time()
+        self.seen_rreqs[rreq_key] = [seen_time, 1]
+        heapq.heappush(self.seen_rreq_heap, (seen_time, rreq_key))
         
         print(f"📥 Received AODV RREQ #{rreq_id} from {source} for {dest} via {sender_ip}")
         
         # Identify node ID for sender_ip to build routing entry
-        sender_id = None
-        for p_id, p_info in self.network.peers.items():
-            if p_info.get('ip') == sender_ip:
-                sender_id = p_id
-                break
+        sender_id = self.network.get_peer_id_by_ip(sender_ip)
         
         if not sender_id:
             sender_id = source  # Fallback placeholder
@@ -174,8 +275,37 @@ class MessageRouter:
             self.send_rrep(source, dest, dest_route['hop_distance'])
             return True
             
-        # Re-broadcast RREQ if max hops not reached
+        # Schedule a jittered re-broadcast if max hops not reached; the
+        # decision is made in process_pending_rreqs once the delay has passed
         if hop_count < self.max_hops:
+            delay = self.rreq_jitter * urandom.getrandbits(16) / 65536
+            self.pending_rreqs[rreq_key] = (time.time() + delay, rreq_data)
+            return True
+        
+        return False
+    
+    def process_pending_rreqs(self):
+        """Re-broadcast RREQs whose random delay has passed, unless suppressed"""
+        if not self.pending_rreqs:
+            return
+        
+        current_time = time.time()
+        # Snapshot: the listener thread may add RREQs while we send
+        for rreq_key, (due_time, rreq_data) in list(self.pending_rreqs.items()):
+            if due_time > current_time:
+                continue
+            del self.pending_rreqs[rreq_key]
+            source, rreq_id = rreq_key
+            heard = self.seen_rreqs[rreq_key][1]
+            
+            # Enough neighbours already re-broadcast it
+            if heard >= self.rreq_counter_threshold:
+                continue
+            # Sparse areas (no duplicate heard) always forward
+            if heard > 1 and urandom.getrandbits(16) >= self.rreq_forward_probability * 65536:
+                continue
+            
+            hop_count = rreq_data.get('hop_count', 0)
             rreq_data['hop_count'] = hop_count + 1
             rreq_data['signature'] = self.crypto.sign_message(rreq_data)
             
@@ -184,11 +314,8 @@ class MessageRouter:
                 rreq_json = json.dumps(rreq_data)
                 self.network.send_direct(rreq_json, broadcast_ip)
                 print(f"📢 Forwarded RREQ #{rreq_id} from {source} (hop: {hop_count + 1})")
-                return True
             except Exception as e:
                 print(f"❌ Failed to forward RREQ: {e}")
-        
-        return False
     
     def send_rrep(self, source, dest, hop_distance):
         """Send AODV Route Reply (RREP) unicast back to the source"""
@@ -225,11 +352,7 @@ class MessageRouter:
         dest = rrep_data.get('destination')
         hop_count = rrep_data.get('hop_count', 0)
         
-        sender_id = None
-        for p_id, p_info in self.network.peers.items():
-            if p_info.get('ip') == sender_ip:
-                sender_id = p_id
-                break
+        sender_id = self.network.get_peer_id_by_ip(sender_ip)
                 
         if not sender_id:
             sender_id = dest  # Fallback
@@ -292,27 +415,41 @@ class MessageRouter:
     def _send_message(self, message, dest_ip):
         """Send message directly to specific IP"""
         try:
-            message_json = json.dumps(message)
+            message_json = message if isinstance(message, str) else json.dumps(message)
             return self.network.send_direct(message_json, dest_ip)
         except Exception as e:
             print(f"❌ Failed to send message: {e}")
             return False
             
     def _cleanup_cache(self):
-        """Remove old entries from message cache"""
+        """Rotate the message cache filters once per cache_ttl"""
         current_time = time.time()
-        expired = [
-            msg_id for msg_id, timestamp in self.message_cache.items()
-            if current_time - timestamp > self.cache_ttl
-        ]
-        for msg_id in expired:
-            del self.message_cache[msg_id]
+        if current_time - self.cache_rotated < self.cache_ttl:
+            return
+        
+        # Recycle the older filter as the new current one
+        expired = self.previous_message_cache
+        expired.clear()
+        self.previous_message_cache = self.message_cache
+        self.message_cache = expired
+        self.cache_rotated = current_time
             
+    def _expire_seen_rreqs(self):
+        """Forget RREQs first seen more than cache_ttl ago, oldest first"""
+        heap = self.seen_rreq_heap
+        cutoff = time.time() - self.cache_ttl
+        while heap and heap[0][0] < cutoff:
+            seen_time, rreq_key = heapq.heappop(heap)
+            entry = self.seen_rreqs.get(rreq_key)
+            # Skip stale heap entries whose RREQ was recorded again since
+            if entry and entry[0] == seen_time:
+                del self.seen_rreqs[rreq_key]
+    
     def get_routing_info(self):
         """Get current routing table information"""
         return {
             'routes': len(self.routing_table),
-            'cached_messages': len(self.message_cache),
+            'cached_messages': self.message_cache.count + self.previous_message_cache.count,
             'routing_table': self.routing_table,
             'max_hops': self.max_hops
         }
@@ -7,11 +7,40 @@ import network
 import socket
 import time
 import json
+import select
+import errno
+import ustruct
 import _thread
 
+# Fixed-schema control packets are sent as binary instead of JSON:
+# type byte, node ID (16 bytes, zero-padded), timestamp in milliseconds.
+# Type bytes stay below 0x20 so they never clash with a JSON packet's '{'.
+# Longer node IDs are rejected rather than truncated into collisions.
+MSG_PING = 0x01
+MSG_PONG = 0x02
+CONTROL_FORMAT = '>B16sQ'
+CONTROL_ID_SIZE = 16
+
+
+def pack_control(msg_type, node_id, timestamp):
+    """Encode a binary control packet"""
+    node_id = node_id.encode()
+    if len(node_id) > CONTROL_ID_SIZE:
+        raise ValueError(f"node ID longer than {CONTROL_ID_SIZE} bytes")
+    return ustruct.pack(CONTROL_FORMAT, msg_type, node_id, int(timestamp * 1000))
+
+
+def unpack_control(data):
+    """Decode a binary control packet into (msg_type, node_id, timestamp)"""
+    msg_type, node_id, timestamp_ms = ustruct.unpack(CONTROL_FORMAT, data)
+    return msg_type, node_id.rstrip(b'\x00').decode(), timestamp_ms / 1000
+
+
 class NetworkManager:
     def __init__(self, node_id, node_name, config):
         """Initialize network manager"""
+        if len(node_id.encode()) > CONTROL_ID_SIZE:
+            raise ValueError(f"node_id must be at most {CONTROL_ID_SIZE} bytes: {node_id}")
         self.node_id = node_id
         self.node_name = node_name
         self.config = config
@@ -27,9 +56,33 @@ class NetworkManager:
         
         self.discovery_socket = None
         self.message_socket = None
+        self.tx_socket = None  # shared outgoing UDP socket, created on first send
+        self.dashboard_sock = None  # keep-alive HTTP connection to the dashboard
+        self.dashboard_prefix = None  # request line and constant headers, built on connect
+        
+        # One I/O thread polls every listening socket
+        self.io_handlers = {}  # socket: (recv size, receive buffer view, callback(data, addr))
+        self.io_pending = []  # sockets waiting to be registered by the I/O thread
+        self.io_running = False
+        self.broadcast_ip = None  # subnet broadcast address, computed on connect
+        self.broadcast_addr = None  # (broadcast_ip, message_port), set on connect
         
         # Peers
-        self.peers = {}  # peer_id: {name, ip, public_key, last_seen, latency, hop_distance, authenticated}
+        self.peers = {}  # peer_id: {name, ip, public_key, latency, hop_distance, connected, authenticated}
+        self.peer_ids_by_ip = {}  # ip: peer_id, for resolving packet senders
+        
+        # Fields swept by the periodic health check, kept as parallel lists
+        # (one slot per peer) so the sweep does not walk every peer dict
+        self._peer_slots = {}  # peer_id: slot
+        self._peer_ids = []
+        self._peer_ips = []
+        self._peer_last_seen = []
+        
+        # Discovery rate limiting
+        self.discovery_min_interval = 5  # seconds between identical broadcasts
+        self.last_discovery_time = 0
+        self.last_discovery_key = None
+        self.discovery_template = None  # (public_key, JSON before timestamp, JSON after)
         
         # State
         self.connected = False
@@ -47,6 +100,8 @@ class NetworkManager:
                 time.sleep(0.5)
         
         self.connected = True
+        self.broadcast_ip = self._compute_broadcast_ip()
+        self.broadcast_addr = (self.broadcast_ip, self.message_port)
         return True
     
     def get_ip(self):
@@ -64,52 +119,67 @@ class NetworkManager:
             self.discovery_socket.setblocking(False)
             print(f"🔍 Discovery service started on port {self.discovery_port}")
             
-            # Start listener thread
-            _thread.start_new_thread(self._discovery_listener, ())
+            self._add_listener(self.discovery_socket, 1024, self._on_discovery_packet)
             
         except Exception as e:
             print(f"❌ Failed to start discovery: {e}")
     
-    def _discovery_listener(self):
-        """Listen for discovery broadcasts"""
-        while self.connected:
-            try:
-                data, addr = self.discovery_socket.recvfrom(1024)
-                # Discovery packets handled by main message handler
-                print(f"📡 Discovery packet from {addr[0]}")
-            except OSError:
-                time.sleep(0.1)  # Non-blocking, so sleep briefly
-            except Exception as e:
-                print(f"❌ Discovery listener error: {e}")
+    def _on_discovery_packet(self, data, addr):
+        """Handle a packet on the discovery port"""
+        # Discovery packets handled by main message handler
+        print(f"📡 Discovery packet from {addr[0]}")
     
     def broadcast_discovery(self, public_key):
         """Broadcast discovery message to find peers"""
+        # Skip a repeat of the same announcement sent moments ago
+        current_time = time.time()
+        if (public_key == self.last_discovery_key and
+                current_time - self.last_discovery_time < self.discovery_min_interval):
+            return False
+        
+        # Only the timestamp changes between broadcasts with the same key
+        template = self.discovery_template
+        if template is None or template[0] != public_key:
+            template = self._build_discovery_template(public_key)
+        packet = template[1] + str(current_time).encode() + template[2]
+        
+        try:
+            # Broadcast to subnet
+            broadcast_addr = self.broadcast_addr or (self._get_broadcast_ip(), self.message_port)
+            self._get_tx_socket().sendto(packet, broadcast_addr)
+            self.last_discovery_time = current_time
+            self.last_discovery_key = public_key
+            print(f"📢 Discovery broadcast sent to {broadcast_addr[0]}")
+            return True
+        except Exception as e:
+            self._reset_tx_socket()
+            print(f"❌ Discovery broadcast failed: {e}")
+            return False
+    
+    def _build_discovery_template(self, public_key):
+        """Serialize the discovery message once, split around its timestamp"""
         discovery_msg = {
             'type': 'DISCOVERY',
             'node_id': self.node_id,
             'node_name': self.node_name,
             'public_key': public_key,
-            'timestamp': time.time()
+            'timestamp': '__TS__'
         }
-        
-        try:
-            # Broadcast to subnet
-            broadcast_ip = self._get_broadcast_ip()
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.sendto(json.dumps(discovery_msg).encode(), (broadcast_ip, self.message_port))
-            sock.close()
-            print(f"📢 Discovery broadcast sent to {broadcast_ip}")
-        except Exception as e:
-            print(f"❌ Discovery broadcast failed: {e}")
+        # Key order isn't guaranteed on MicroPython, so split on a placeholder
+        encoded = json.dumps(discovery_msg).encode()
+        split = encoded.find(b'"__TS__"')
+        self.discovery_template = (public_key, encoded[:split], encoded[split + 8:])
+        return self.discovery_template
     
     def _get_broadcast_ip(self):
         """Get broadcast IP for current subnet"""
+        return self.broadcast_ip or self._compute_broadcast_ip()
+    
+    def _compute_broadcast_ip(self):
+        """Derive the subnet broadcast IP from the current address"""
         ip = self.get_ip()
         if ip:
-            parts = ip.split('.')
-            parts[-1] = '255'
-            return '.'.join(parts)
+            return ip[:ip.rfind('.') + 1] + '255'
         return '255.255.255.255'
     
     def start_message_listener(self, message_handler):
@@ -120,55 +190,184 @@ class NetworkManager:
             self.message_socket.setblocking(False)
             print(f"📨 Message listener started on port {self.message_port}")
             
-            # Start listener thread
-            _thread.start_new_thread(self._message_listener, (message_handler,))
+            def on_message(data, addr):
+                if data and data[0] < 0x20:
+                    # Binary control packet, handed over undecoded
+                    message_handler(data, addr)
+                else:
+                    message_handler(str(data, 'utf-8'), addr)
+            
+            self._add_listener(self.message_socket, 2048, on_message)
             
         except Exception as e:
             print(f"❌ Failed to start message listener: {e}")
     
-    def _message_listener(self, message_handler):
-        """Listen for incoming messages"""
+    def _add_listener(self, sock, recv_size, callback):
+        """Hand a listening socket to the I/O thread, starting it if needed"""
+        # Packets are received into one reused buffer where the port supports it;
+        # callbacks get a memoryview that is only valid until the next packet
+        rx_view = memoryview(bytearray(recv_size)) if hasattr(sock, 'recvfrom_into') else None
+        self.io_handlers[sock] = (recv_size, rx_view, callback)
+        self.io_pending.append(sock)
+        
+        if not self.io_running:
+            self.io_running = True
+            _thread.start_new_thread(self._io_loop, ())
+    
+    def _io_loop(self):
+        """Wait on all listening sockets at once and dispatch incoming packets"""
+        poller = select.poll()
+        sockets = {}
+        
         while self.connected:
-            try:
-                data, addr = self.message_socket.recvfrom(2048)
-                message = data.decode('utf-8')
-                message_handler(message, addr)
-            except OSError:
-                time.sleep(0.05)
-            except Exception as e:
-                print(f"❌ Message listener error: {e}")
+            # Register sockets added since the last wake-up from this thread
+            while self.io_pending:
+                sock = self.io_pending.pop()
+                poller.register(sock, select.POLLIN)
+                sockets[sock] = sock
+                # MicroPython's poll reports the socket, CPython's its file descriptor
+                if hasattr(sock, 'fileno'):
+                    sockets[sock.fileno()] = sock
+            
+            for obj, event in poller.poll(1000):
+                sock = sockets.get(obj)
+                if sock is None:
+                    continue
+                if event & (select.POLLERR | select.POLLHUP):
+                    # Closed or failed socket: poll would report it on every pass
+                    poller.unregister(sock)
+                    for key in [key for key, value in sockets.items() if value is sock]:
+                        del sockets[key]
+                    print("⚠️  Listener socket closed, no longer polled")
+                    continue
+                recv_size, rx_view, callback = self.io_handlers[sock]
+                try:
+                    if rx_view is not None:
+                        nbytes, addr = sock.recvfrom_into(rx_view)
+                        data = rx_view[:nbytes]
+                    else:
+                        data, addr = sock.recvfrom(recv_size)
+                    callback(data, addr)
+                except OSError as e:
+                    if e.args[0] not in (errno.EAGAIN, errno.ETIMEDOUT):
+                        print(f"❌ Listener error: {e}")
+                    # Otherwise a spurious wake-up
+                except Exception as e:
+                    print(f"❌ Listener error: {e}")
+        
+        self.io_running = False
     
     def send_direct(self, message, dest_ip):
-        """Send message directly to specific IP"""
+        """Send message (JSON string or binary packet) directly to specific IP"""
+        if isinstance(message, str):
+            message = message.encode()
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.sendto(message.encode(), (dest_ip, self.message_port))
-            sock.close()
+            self._get_tx_socket().sendto(message, (dest_ip, self.message_port))
             return True
         except Exception as e:
+            self._reset_tx_socket()
             print(f"❌ Failed to send to {dest_ip}: {e}")
             return False
     
-    def send_to_dashboard(self, data, dashboard_ip):
-        """Send data to dashboard server via HTTP POST"""
-        try:
-            # Simple HTTP POST request
+    def _get_tx_socket(self):
+        """Get the shared outgoing UDP socket (broadcast-enabled)"""
+        if self.tx_socket is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            self.tx_socket = sock
+        return self.tx_socket
+    
+    def _reset_tx_socket(self):
+        """Drop the outgoing socket after an error so the next send reopens it"""
+        if self.tx_socket:
+            try:
+                self.tx_socket.close()
+            except Exception:
+                pass
+            self.tx_socket = None
+    
+    def _get_dashboard_socket(self, dashboard_ip):
+        """Get the keep-alive connection to the dashboard, opening it if needed"""
+        # Servers that answer HTTP/1.0 or Connection: close (such as the
+        # dashboard under Flask-SocketIO's default threading/werkzeug server)
+        # end up with a fresh connection per report
+        if self.dashboard_sock is None:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((dashboard_ip, self.dashboard_port))
-            
-            request = f"POST /api/update_node HTTP/1.1\r\n"
-            request += f"Host: {dashboard_ip}\r\n"
-            request += "Content-Type: application/json\r\n"
-            request += f"Content-Length: {len(data)}\r\n"
-            request += "\r\n"
-            request += data
-            
-            sock.send(request.encode())
-            sock.close()
-            return True
-        except Exception as e:
-            print(f"⚠️  Dashboard send failed: {e}")
-            return False
+            try:
+                sock.settimeout(5)
+                sock.connect((dashboard_ip, self.dashboard_port))
+            except Exception:
+                sock.close()
+                raise
+            self.dashboard_sock = sock
+            self.dashboard_prefix = (b"POST /api/update_node HTTP/1.1\r\n"
+                                     b"Host: " + dashboard_ip.encode() + b"\r\n"
+                                     b"Content-Type: application/json\r\n"
+                                     b"Connection: keep-alive\r\n"
+                                     b"Content-Length: ")
+        return self.dashboard_sock
+    
+    def _reset_dashboard_socket(self):
+        """Drop the dashboard connection so the next send reconnects"""
+        if self.dashboard_sock:
+            try:
+                self.dashboard_sock.close()
+            except Exception:
+                pass
+            self.dashboard_sock = None
+    
+    def _read_dashboard_reply(self, sock):
+        """Consume one HTTP response; returns (status code, whether the connection can be reused)"""
+        reply = b''
+        while True:
+            chunk = sock.recv(512)
+            if not chunk:
+                raise OSError('connection closed by dashboard')
+            reply += chunk
+            header_end = reply.find(b'\r\n\r\n')
+            if header_end >= 0:
+                break
+        
+        # Status line: HTTP/1.x NNN reason
+        status = int(reply[9:12]) if reply.startswith(b'HTTP/1.') else 0
+        
+        headers = reply[:header_end + 2].lower()
+        start = headers.find(b'content-length:')
+        if start < 0 or b'connection: close' in headers:
+            return status, False
+        length = int(headers[start + 15:headers.find(b'\r\n', start)])
+        
+        remaining = length - (len(reply) - header_end - 4)
+        while remaining > 0:
+            chunk = sock.recv(min(remaining, 512))
+            if not chunk:
+                return status, False
+            remaining -= len(chunk)
+        return status, True
+    
+    def send_to_dashboard(self, data, dashboard_ip):
+        """Send data to dashboard server via HTTP POST; True only on a 2xx reply"""
+        body = data.encode() if isinstance(data, str) else data
+        
+        # A kept-alive connection may have been closed by the server since the
+        # last report, so retry once on a fresh one
+        for attempt in range(2):
+            try:
+                sock = self._get_dashboard_socket(dashboard_ip)
+                sock.send(self.dashboard_prefix + str(len(body)).encode() + b"\r\n\r\n" + body)
+                
+                status, reusable = self._read_dashboard_reply(sock)
+                if not reusable:
+                    self._reset_dashboard_socket()
+                if not 200 <= status < 300:
+                    print(f"⚠️  Dashboard rejected update ({status})")
+                    return False
+                return True
+            except Exception as e:
+                self._reset_dashboard_socket()
+                if attempt:
+                    print(f"⚠️  Dashboard send failed: {e}")
+        return False
     
     def add_peer(self, peer_id, peer_name, peer_ip, public_key, hop_distance=1, authenticated=False):
         """Add or update peer information"""
@@ -180,17 +379,27 @@ class NetworkManager:
             existing_peer = self.peers[peer_id]
             if hop_distance == 1:  # Only update hop_distance if explicitly provided
                 hop_distance = existing_peer.get('hop_distance', 1)
+            if self.peer_ids_by_ip.get(existing_peer['ip']) == peer_id:
+                del self.peer_ids_by_ip[existing_peer['ip']]
+            slot = self._peer_slots[peer_id]
+            self._peer_ips[slot] = peer_ip
+            self._peer_last_seen[slot] = time.time()
+        else:
+            self._peer_slots[peer_id] = len(self._peer_ids)
+            self._peer_ids.append(peer_id)
+            self._peer_ips.append(peer_ip)
+            self._peer_last_seen.append(time.time())
         
         self.peers[peer_id] = {
             'name': peer_name,
             'ip': peer_ip,
             'public_key': public_key,
-            'last_seen': time.time(),
             'latency': None,
             'hop_distance': hop_distance,
             'connected': True,
             'authenticated': authenticated
         }
+        self.peer_ids_by_ip[peer_ip] = peer_id
         
         status = "✅" if authenticated else "⚠️"
         print(f"{status} Peer added: {peer_name} ({peer_ip}) [hops: {hop_distance}, auth: {authenticated}]")
@@ -199,6 +408,10 @@ class NetworkManager:
         """Get peer information"""
         return self.peers.get(peer_id)
     
+    def get_peer_id_by_ip(self, peer_ip):
+        """Get the ID of the peer at an IP address, or None"""
+        return self.peer_ids_by_ip.get(peer_ip)
+    
     def get_peer_list(self):
         """Get list of all peers"""
         return [
@@ -206,7 +419,7 @@ class NetworkManager:
                 'id': peer_id,
                 'name': info['name'],
                 'ip': info['ip'],
-                'last_seen': info['last_seen'],
+                'last_seen': self._peer_last_seen[self._peer_slots[peer_id]],
                 'latency': info.get('latency'),
                 'hop_distance': info.get('hop_distance', 1),
                 'connected': info.get('connected', True),
@@ -219,7 +432,7 @@ class NetworkManager:
         """Update hop distance for a peer"""
         if peer_id in self.peers:
             self.peers[peer_id]['hop_distance'] = hop_distance
-            self.peers[peer_id]['last_seen'] = time.time()
+            self._peer_last_seen[self._peer_slots[peer_id]] = time.time()
     
     def mark_peer_authenticated(self, peer_id):
         """Mark peer as authenticated"""
@@ -231,7 +444,20 @@ class NetworkManager:
         """Remove peer from peer list (for unauthorized nodes)"""
         if peer_id in self.peers:
             peer_name = self.peers[peer_id]['name']
-            del self.peers[peer_id]
+            peer_ip = self.peers.pop(peer_id)['ip']
+            if self.peer_ids_by_ip.get(peer_ip) == peer_id:
+                del self.peer_ids_by_ip[peer_ip]
+            
+            # Move the last slot into the freed one
+            slot = self._peer_slots.pop(peer_id)
+            last_id = self._peer_ids.pop()
+            last_ip = self._peer_ips.pop()
+            last_seen = self._peer_last_seen.pop()
+            if last_id != peer_id:
+                self._peer_ids[slot] = last_id
+                self._peer_ips[slot] = last_ip
+                self._peer_last_seen[slot] = last_seen
+                self._peer_slots[last_id] = slot
             print(f"🚫 Peer removed: {peer_name} ({peer_id})")
     
     def check_peer_health(self):
@@ -239,31 +465,30 @@ class NetworkManager:
         current_time = time.time()
         timeout = 60  # seconds
         
-        for peer_id, info in self.peers.items():
-            if current_time - info['last_seen'] > timeout:
+        # Snapshot, since the listener thread may add or remove peers meanwhile;
+        # zip stops at the shortest list if one changed between the copies,
+        # and a peer half-way through add/remove has no dict entry yet
+        peer_ids = list(self._peer_ids)
+        last_seen = list(self._peer_last_seen)
+        ping_ips = list(self._peer_ips)
+        for peer_id, seen in zip(peer_ids, last_seen):
+            if current_time - seen > timeout:
+                info = self.peers.get(peer_id)
+                if info is None:
+                    continue
                 info['connected'] = False
                 print(f"⚠️  Peer timeout: {info['name']}")
-            
-            # Send ping to measure latency
-            self._ping_peer(peer_id, info['ip'])
-    
-    def _ping_peer(self, peer_id, peer_ip):
-        """Send ping to peer to measure latency"""
-        try:
-            ping_msg = {
-                'type': 'PING',
-                'node_id': self.node_id,
-                'timestamp': time.time()
-            }
-            self.send_direct(json.dumps(ping_msg), peer_ip)
-        except Exception as e:
-            print(f"⚠️  Ping failed for {peer_id}: {e}")
+        
+        # Ping everyone with one shared packet to measure latency
+        ping = pack_control(MSG_PING, self.node_id, current_time)
+        for peer_ip in ping_ips:
+            self.send_direct(ping, peer_ip)
     
     def update_peer_latency(self, peer_id, latency):
         """Update peer latency measurement"""
         if peer_id in self.peers:
             self.peers[peer_id]['latency'] = latency
-            self.peers[peer_id]['last_seen'] = time.time()
+            self._peer_last_seen[self._peer_slots[peer_id]] = time.time()
             self.peers[peer_id]['connected'] = True
     
     def stop(self):
@@ -276,5 +501,8 @@ class NetworkManager:
         if self.message_socket:
             self.message_socket.close()
         
+        self._reset_tx_socket()
+        self._reset_dashboard_socket()
+        
         print("🛑 Network services stopped")
 
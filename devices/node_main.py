@@ -7,7 +7,8 @@ import network
 import time
 import json
 import ubinascii
-from network_manager import NetworkManager
+import _thread
+from network_manager import NetworkManager, MSG_PING, MSG_PONG, pack_control, unpack_control
 from crypto_utils import CryptoManager
 from message_router import MessageRouter
 
@@ -31,14 +32,29 @@ class NexLatticeNode:
         self.network = NetworkManager(self.node_id, self.node_name, self.config)
         self.router = MessageRouter(self.node_id, self.network, self.crypto)
         
+        # Last DISCOVERY_RESPONSE per peer, to answer each peer's repeated
+        # discovery broadcasts at most once per interval
+        self.discovery_responses = {}  # peer_id: timestamp
+        self.discovery_response_interval = 10  # seconds
+        
         # State
         self.running = False
         self.stats = {
             'messages_sent': 0,
             'messages_received': 0,
             'messages_forwarded': 0,
+            'messages_failed': 0,  # routing failures and TX queue overflows
             'uptime': 0
         }
+        self.last_reported_stats = {}  # stats as last acknowledged by the dashboard
+        
+        # Outgoing messages are encrypted, signed and routed by a worker
+        # thread so crypto work does not stall the main loop
+        self.tx_queue = []
+        self.tx_queue_limit = 32  # oldest queued message is dropped beyond this
+        self.tx_lock = _thread.allocate_lock()
+        self.tx_ready = _thread.allocate_lock()  # released when messages are queued
+        self.tx_ready.acquire()
         
         print(f"✅ Node initialized: {self.node_name} ({self.node_id})")
     
@@ -62,6 +78,7 @@ class NexLatticeNode:
         
         # Start periodic tasks
         self.running = True
+        _thread.start_new_thread(self._tx_worker, ())
         self.run_main_loop()
         
         return True
@@ -69,25 +86,22 @@ class NexLatticeNode:
     def handle_message(self, message, sender_addr):
         """Handle incoming messages"""
         try:
+            if not isinstance(message, str):
+                # Binary control packet (bytes or a view of the receive buffer)
+                self.handle_control_packet(message, sender_addr)
+                self.stats['messages_received'] += 1
+                return
+            
             msg_data = json.loads(message)
             msg_type = msg_data.get('type')
             
-            if msg_type == 'DISCOVERY':
-                self.handle_discovery(msg_data, sender_addr)
-            elif msg_type == 'DISCOVERY_RESPONSE':
-                self.handle_discovery_response(msg_data, sender_addr)
-            elif msg_type == 'KEY_EXCHANGE':
-                self.handle_key_exchange(msg_data, sender_addr)
-            elif msg_type == 'AUTH_RESPONSE':
-                self.handle_auth_response(msg_data, sender_addr)
-            elif msg_type == 'DATA':
-                self.handle_data_message(msg_data, sender_addr)
-            elif msg_type == 'PING':
-                self.handle_ping(msg_data, sender_addr)
-            elif msg_type == 'AODV_RREQ':
-                self.handle_aodv_rreq(msg_data, sender_addr)
-            elif msg_type == 'AODV_RREP':
-                self.handle_aodv_rrep(msg_data, sender_addr)
+            if msg_type == 'DATA':
+                # Forwarding reuses the received JSON text
+                self.handle_data_message(msg_data, sender_addr, message)
+            else:
+                handler = self._HANDLERS.get(msg_type)
+                if handler:
+                    handler(self, msg_data, sender_addr)
             
             self.stats['messages_received'] += 1
             
@@ -102,6 +116,20 @@ class NexLatticeNode:
         
         print(f"🔍 Discovery from {peer_name} ({peer_id})")
         
+        # Already answered this peer recently
+        current_time = time.time()
+        last_response = self.discovery_responses.get(peer_id)
+        if last_response and current_time - last_response < self.discovery_response_interval:
+            return
+        
+        # Forget stale entries before adding, so spoofed IDs cannot pile up
+        if len(self.discovery_responses) >= 64:
+            self.discovery_responses = {
+                p_id: ts for p_id, ts in self.discovery_responses.items()
+                if current_time - ts < self.discovery_response_interval
+            }
+        self.discovery_responses[peer_id] = current_time
+        
         # Generate authentication challenge
         challenge = self.crypto.generate_challenge(peer_id)
         
@@ -190,7 +218,7 @@ class NexLatticeNode:
         print(f"✅ Authentication successful for {peer_id}")
         self.network.mark_peer_authenticated(peer_id)
     
-    def handle_data_message(self, msg_data, sender_addr):
+    def handle_data_message(self, msg_data, sender_addr, raw=None):
         """Handle data message (direct or forwarded)"""
         # Verify signature first (mandatory)
         signature = msg_data.get('signature')
@@ -222,24 +250,33 @@ class NexLatticeNode:
         else:
             # Forward message
             print(f"📤 Forwarding message from {source_id} to {dest_id}")
-            self.router.forward_message(msg_data)
+            self.router.forward_message(msg_data, raw)
             self.stats['messages_forwarded'] += 1
     
+    def handle_control_packet(self, packet, sender_addr):
+        """Handle binary control packet (PING/PONG)"""
+        msg_type, peer_id, timestamp = unpack_control(packet)
+        
+        if msg_type == MSG_PING:
+            self.handle_ping({'node_id': peer_id, 'timestamp': timestamp}, sender_addr)
+    
     def handle_ping(self, msg_data, sender_addr):
         """Handle ping request for latency measurement"""
         peer_id = msg_data.get('node_id')
         
         # Send pong response
-        pong = {
-            'type': 'PONG',
-            'node_id': self.node_id,
-            'timestamp': time.time()
-        }
+        pong = pack_control(MSG_PONG, self.node_id, time.time())
         
-        self.network.send_direct(json.dumps(pong), sender_addr[0])
+        self.network.send_direct(pong, sender_addr[0])
     
     def send_message(self, dest_id, payload, encrypted=True):
-        """Send a message to another node"""
+        """Send a message to another node
+        
+        While the node is running the message is queued for the tx worker and
+        True means queued, not delivered; routing failures and queue overflows
+        are counted in stats['messages_failed'] and logged. Before start() the
+        message is sent inline and the routing result is returned.
+        """
         message = {
             'type': 'DATA',
             'source': self.node_id,
@@ -250,10 +287,42 @@ class NexLatticeNode:
             'timestamp': time.time()
         }
         
+        if not self.running:
+            return self._transmit_message(message)
+        
+        with self.tx_lock:
+            self.tx_queue.append(message)
+            if len(self.tx_queue) > self.tx_queue_limit:
+                dropped = self.tx_queue.pop(0)
+                self.stats['messages_failed'] += 1
+                print(f"⚠️  TX queue full, dropped message to {dropped['destination']}")
+            if self.tx_ready.locked():
+                self.tx_ready.release()
+        return True
+    
+    def _tx_worker(self):
+        """Drain the outgoing message queue"""
+        while self.running:
+            self.tx_ready.acquire()
+            while True:
+                with self.tx_lock:
+                    if not self.tx_queue:
+                        break
+                    message = self.tx_queue.pop(0)
+                try:
+                    self._transmit_message(message)
+                except Exception as e:
+                    self.stats['messages_failed'] += 1
+                    print(f"❌ Error sending message: {e}")
+    
+    def _transmit_message(self, message):
+        """Encrypt, sign and route an outgoing message"""
+        dest_id = message['destination']
+        
         # Encrypt if requested
-        if encrypted:
+        if message['encrypted']:
             # Encrypt the payload
-            message['payload'] = self.crypto.encrypt(payload, dest_id)
+            message['payload'] = self.crypto.encrypt(message['payload'], dest_id)
         
         # Sign message (mandatory) - sign after encryption
         message['signature'] = self.crypto.sign_message(message)
@@ -265,20 +334,26 @@ class NexLatticeNode:
             self.stats['messages_sent'] += 1
             print(f"✅ Message sent to {dest_id}")
         else:
+            self.stats['messages_failed'] += 1
             print(f"❌ Failed to send message to {dest_id}")
         
         return success
     
     def run_main_loop(self):
         """Main loop for periodic tasks"""
-        last_discovery = 0
-        last_health_check = 0
-        last_stats_report = 0
         start_time = time.time()
         
         DISCOVERY_INTERVAL = 30  # seconds
         HEALTH_CHECK_INTERVAL = 10  # seconds
         STATS_REPORT_INTERVAL = 60  # seconds
+        MAX_IDLE = 1  # seconds; bounds the wait for RREQs queued by the listener thread
+        
+        tasks = (
+            (DISCOVERY_INTERVAL, self.broadcast_discovery),  # Periodic discovery broadcast
+            (HEALTH_CHECK_INTERVAL, self.network.check_peer_health),  # Health check for peers
+            (STATS_REPORT_INTERVAL, self.report_stats),  # Report stats to dashboard
+        )
+        last_run = [0] * len(tasks)
         
         print("🔄 Entering main loop...")
         
@@ -287,22 +362,22 @@ class NexLatticeNode:
                 current_time = time.time()
                 self.stats['uptime'] = int(current_time - start_time)
                 
-                # Periodic discovery broadcast
-                if current_time - last_discovery > DISCOVERY_INTERVAL:
-                    self.network.broadcast_discovery(self.crypto.get_public_key())
-                    last_discovery = current_time
-                
-                # Health check for peers
-                if current_time - last_health_check > HEALTH_CHECK_INTERVAL:
-                    self.network.check_peer_health()
-                    last_health_check = current_time
+                next_due = current_time + MAX_IDLE
+                for i, (interval, task) in enumerate(tasks):
+                    if current_time - last_run[i] >= interval:
+                        task()
+                        last_run[i] = current_time
+                    next_due = min(next_due, last_run[i] + interval)
                 
-                # Report stats to dashboard
-                if current_time - last_stats_report > STATS_REPORT_INTERVAL:
-                    self.report_stats()
-                    last_stats_report = current_time
+                # Jittered RREQ re-broadcasts that are due
+                self.router.process_pending_rreqs()
+                for due_time, _ in list(self.router.pending_rreqs.values()):
+                    next_due = min(next_due, due_time)
                 
-                time.sleep(0.1)  # Small delay to prevent tight loop
+                # Idle until the next task or RREQ deadline
+                delay = next_due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
                 
             except KeyboardInterrupt:
                 print("\n⏹️  Stopping node...")
@@ -311,25 +386,43 @@ class NexLatticeNode:
             except Exception as e:
                 print(f"❌ Error in main loop: {e}")
     
+    def broadcast_discovery(self):
+        """Announce this node to the subnet"""
+        self.network.broadcast_discovery(self.crypto.get_public_key())
+    
     def report_stats(self):
         """Report node statistics to dashboard"""
+        # Send to dashboard server if configured
+        dashboard_ip = self.config.get('dashboard_ip')
+        if not dashboard_ip:
+            return
+        
+        # Only send stats that changed; a new dashboard connection gets all of them
+        if self.network.dashboard_sock is None:
+            self.last_reported_stats = {}
+        reported = self.last_reported_stats
+        changed = {key: value for key, value in self.stats.items() if reported.get(key) != value}
+        
         stats_data = {
             'type': 'STATS',
             'node_id': self.node_id,
             'node_name': self.node_name,
             'peers': self.network.get_peer_list(),
-            'stats': self.stats,
+            'stats': changed,
             'timestamp': time.time()
         }
         
-        # Send to dashboard server if configured
-        dashboard_ip = self.config.get('dashboard_ip')
-        if dashboard_ip:
-            try:
-                self.network.send_to_dashboard(json.dumps(stats_data), dashboard_ip)
+        try:
+            connection = self.network.dashboard_sock
+            if self.network.send_to_dashboard(json.dumps(stats_data), dashboard_ip):
+                if connection is None or self.network.dashboard_sock is connection:
+                    reported.update(changed)
+                else:
+                    # Delta went out on a reconnect; send everything next time
+                    self.last_reported_stats = {}
                 print(f"📊 Stats reported: {len(self.network.peers)} peers, {self.stats['messages_sent']} sent")
-            except Exception as e:
-                print(f"⚠️  Could not report stats: {e}")
+        except Exception as e:
+            print(f"⚠️  Could not report stats: {e}")
     
     def handle_aodv_rreq(self, msg_data, sender_addr):
         """Handle incoming AODV Route Request (RREQ)"""
@@ -352,6 +445,12 @@ class NexLatticeNode:
     def stop(self):
         """Stop the node gracefully"""
         self.running = False
+        
+        # Wake the tx worker so it sees the node stopping
+        with self.tx_lock:
+            if self.tx_ready.locked():
+                self.tx_ready.release()
+        
         self.network.stop()
         print("✅ Node stopped")
     
@@ -366,6 +465,19 @@ class NexLatticeNode:
         }
 
 
+# Message type -> handler, looked up once per received message (DATA is
+# dispatched separately so it also gets the raw JSON)
+NexLatticeNode._HANDLERS = {
+    'DISCOVERY': NexLatticeNode.handle_discovery,
+    'DISCOVERY_RESPONSE': NexLatticeNode.handle_discovery_response,
+    'KEY_EXCHANGE': NexLatticeNode.handle_key_exchange,
+    'AUTH_RESPONSE': NexLatticeNode.handle_auth_response,
+    'PING': NexLatticeNode.handle_ping,
+    'AODV_RREQ': NexLatticeNode.handle_aodv_rreq,
+    'AODV_RREP': NexLatticeNode.handle_aodv_rrep
+}
+
+
 def main():
     """Entry point"""
     node = NexLatticeNode()
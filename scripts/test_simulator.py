@@ -31,9 +31,7 @@ def run_basic_test():
     # Send messages
     print("\n📤 Sending test messages...")
     sim.send_test_message("node_001", "node_002", "Hello, neighbor!")
-    time.sleep(1)
-    sim.send_test_message("node_001", "node_005", "Multi-hop message!")
-    time.sleep(1)
+    sim.send_test_message("node_001", "node_005", "Multi-hop message!", trace=True)
     
     # Stats
     sim.print_network_stats()
@@ -42,17 +40,13 @@ def run_basic_test():
     print("\n💥 Test 2: Node Failure Simulation")
     print("-" * 40)
     sim.simulate_node_failure("node_003")
-    time.sleep(1)
     sim.send_test_message("node_001", "node_005", "Testing with failure")
-    time.sleep(1)
     
     # Test 3: Node recovery
     print("\n✅ Test 3: Node Recovery")
     print("-" * 40)
     sim.simulate_node_recovery("node_003")
-    time.sleep(1)
     sim.send_test_message("node_001", "node_005", "Testing after recovery")
-    time.sleep(1)
     
     # Final stats
     sim.print_network_stats()
@@ -105,11 +99,9 @@ def run_advanced_test():
         
         # Send messages
         sim.send_test_message("node_001", "node_005", f"Test on {topology} topology")
-        time.sleep(0.5)
         
         # Stats
         sim.print_network_stats()
-        time.sleep(1)
     
     print("\n✅ Advanced test complete!\n")
 
@@ -5,30 +5,81 @@ Helper script to upload NexLattice code to ESP32 boards
 
 import os
 import sys
-import subprocess
+import time
 import argparse
 
-def check_ampy():
-    """Check if ampy is installed"""
-    try:
-        subprocess.run(['ampy', '--version'], capture_output=True, check=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+try:
+    import serial
+    SERIAL_AVAILABLE = True
+except ImportError:
+    SERIAL_AVAILABLE = False
 
-def upload_file(port, local_file, remote_file):
-    """Upload a single file to ESP32"""
-    print(f"  Uploading {local_file} -> {remote_file}")
-    try:
-        subprocess.run(
-            ['ampy', '--port', port, 'put', local_file, remote_file],
-            check=True,
-            capture_output=True
-        )
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"  ❌ Error: {e.stderr.decode()}")
-        return False
+CHUNK_SIZE = 1024  # file bytes per f.write() executed on the board
+
+class ReplError(Exception):
+    """The board did not respond as expected or raised an error"""
+
+class RawRepl:
+    """One serial session to a MicroPython board driven through the raw REPL"""
+    
+    def __init__(self, port, baudrate=115200):
+        self.serial = serial.Serial(port, baudrate, timeout=1)
+    
+    def enter(self):
+        """Interrupt any running program and switch to raw REPL"""
+        self.serial.write(b'\r\x03\x03')  # Ctrl-C twice
+        time.sleep(0.1)
+        self.serial.reset_input_buffer()
+        self.serial.write(b'\r\x01')  # Ctrl-A
+        self._read_until(b'raw REPL; CTRL-B to exit\r\n>')
+    
+    def exit(self):
+        """Return to the friendly REPL"""
+        self.serial.write(b'\r\x02')  # Ctrl-B
+    
+    def close(self):
+        """Release the serial port"""
+        self.serial.close()
+    
+    def run(self, code):
+        """Run code on the board and return its output"""
+        data = code.encode()
+        # Small writes with pauses so the board's UART buffer never overflows
+        for i in range(0, len(data), 256):
+            self.serial.write(data[i:i + 256])
+            time.sleep(0.01)
+        self.serial.write(b'\x04')  # Ctrl-D executes
+        
+        if self.serial.read(2) != b'OK':
+            raise ReplError('board did not accept code')
+        output = self._read_until(b'\x04')[:-1]
+        error = self._read_until(b'\x04')[:-1]
+        self._read_until(b'>')
+        if error:
+            raise ReplError(error.decode(errors='replace').strip())
+        return output
+    
+    def put(self, local_file, remote_file):
+        """Copy a local file onto the board's filesystem"""
+        with open(local_file, 'rb') as f:
+            content = f.read()
+        
+        self.run(f"f=open({remote_file!r},'wb')\nw=f.write")
+        for i in range(0, len(content), CHUNK_SIZE):
+            self.run(f"w({content[i:i + CHUNK_SIZE]!r})")
+        self.run("f.close()")
+    
+    def _read_until(self, ending, timeout=10):
+        """Read from the board until ending arrives"""
+        data = b''
+        deadline = time.time() + timeout
+        while not data.endswith(ending):
+            byte = self.serial.read(1)
+            if byte:
+                data += byte
+            elif time.time() > deadline:
+                raise ReplError(f'timed out waiting for {ending!r}')
+        return data
 
 def upload_nexlattice(port, node_number):
     """Upload all NexLattice files to ESP32"""
@@ -54,17 +105,38 @@ def upload_nexlattice(port, node_number):
         print(f"  ⚠️  Warning: Config file {config_file} not found")
         return False
     
-    # Upload each file
-    success_count = 0
-    for local, remote in files:
-        if not os.path.exists(local):
+    # Check every file before touching the serial port
+    missing = [local for local, _ in files if not os.path.exists(local)]
+    if missing:
+        for local in missing:
             print(f"  ❌ File not found: {local}")
-            continue
-        
-        if upload_file(port, local, remote):
-            success_count += 1
-        else:
-            print(f"  ❌ Failed to upload {local}")
+        return False
+    
+    # Upload every file over one raw REPL session
+    success_count = 0
+    try:
+        repl = RawRepl(port)
+    except serial.SerialException as e:
+        print(f"  ❌ Error: could not open {port}: {e}")
+        return False
+    
+    # Always release the port, even on errors or Ctrl+C
+    try:
+        repl.enter()
+        for local, remote in files:
+            print(f"  Uploading {local} -> {remote}")
+            try:
+                repl.put(local, remote)
+                success_count += 1
+            except (serial.SerialException, ReplError) as e:
+                print(f"  ❌ Error: {e}")
+                print(f"  ❌ Failed to upload {local}")
+        repl.exit()
+    except (serial.SerialException, ReplError) as e:
+        print(f"  ❌ Error: could not open REPL on {port}: {e}")
+        return False
+    finally:
+        repl.close()
     
     print(f"\n✅ Uploaded {success_count}/{len(files)} files successfully")
     return success_count == len(files)
@@ -120,10 +192,10 @@ Examples:
         print("\nTip: Use --list to see available ports")
         return 1
     
-    # Check if ampy is installed
-    if not check_ampy():
-        print("❌ Error: ampy is not installed")
-        print("\nInstall with: pip install adafruit-ampy")
+    # Check if pyserial is installed
+    if not SERIAL_AVAILABLE:
+        print("❌ Error: pyserial is not installed")
+        print("\nInstall with: pip install pyserial")
         return 1
     
     # Upload files
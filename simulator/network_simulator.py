@@ -3,16 +3,75 @@ NexLattice Network Simulator
 Test the mesh network virtually before deploying to ESP32s
 """
 
+import math
 import random
 import time
 import json
+import zlib
+import heapq
+import itertools
 import threading
-from collections import defaultdict
+import dataclasses
+from collections import defaultdict, deque
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+DISCOVERY_RANGE = 300  # max distance (arbitrary units) at which nodes see each other
+MESSAGE_CACHE_SIZE = 128  # recent sequence numbers per source each node remembers for loop prevention
+
+
+def dumps_bytes(obj):
+    """Serialize obj to compact JSON bytes (orjson when installed)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+@dataclasses.dataclass
+class Message:
+    """A simulated DATA message; each hop gets a new instance sharing the payload"""
+    __slots__ = ('type', 'source', 'destination', 'payload', 'hop_count',
+                 'msg_id', 'path', 'timestamp', 'flooded', 'trace')
+    type: str
+    source: str
+    destination: str
+    payload: object
+    hop_count: int
+    msg_id: int
+    path: tuple
+    timestamp: float
+    flooded: bool
+    trace: bool  # record the full path (debugging); otherwise only hop_count is kept
+
+
+@dataclasses.dataclass
+class PeerInfo:
+    """What a node knows about one discovered peer"""
+    __slots__ = ('name', 'distance', 'latency', 'node')
+    name: str
+    distance: float
+    latency: float  # simulated link latency in ms
+    node: 'SimulatedNode'
+
 
 class SimulatedNode:
     """Simulates a NexLattice node in software"""
     
+    __slots__ = ('node_id', 'node_name', 'position', 'online', 'peers', 'stats',
+                 'message_queue', 'routing_table', 'message_windows',
+                 'numeric_id', 'msg_seq', 'on_delivery', 'simulator', 'start_time', 'status_cache')
+    
     def __init__(self, node_id, node_name, position=(0, 0)):
         self.node_id = node_id
         self.node_name = node_name
@@ -20,7 +79,7 @@ class SimulatedNode:
         
         # Node state
         self.online = True
-        self.peers = {}  # peer_id: {name, distance, latency}
+        self.peers = {}  # peer_id: PeerInfo
         self.stats = {
             'messages_sent': 0,
             'messages_received': 0,
@@ -34,30 +93,48 @@ class SimulatedNode:
         # Routing table
         self.routing_table = {}
         
-        # Message cache for loop prevention
-        self.message_cache = set()
+        # Message cache for loop prevention: per source, the highest sequence
+        # number seen plus a bitmask of the MESSAGE_CACHE_SIZE below it
+        self.message_windows = {}  # source numeric_id -> (highest seq, bitmask)
+        # msg_ids are (numeric_id << 32) | seq so the cache holds plain ints
+        self.numeric_id = zlib.crc32(node_id.encode())
+        self.msg_seq = itertools.count(1)
+        
+        # Called with each message delivered to this node
+        self.on_delivery = None
+        
+        # Owning NetworkSimulator, whose virtual clock schedules link delays
+        self.simulator = None
         
         self.start_time = time.time()
         
+        # (topology version, serialized report minus stats) for status_json
+        self.status_cache = None
+        
         print(f"✅ Simulated node created: {self.node_name} ({self.node_id})")
     
-    def discover_peer(self, peer_node):
-        """Discover and add a peer"""
+    def discover_peer(self, peer_node, distance=None):
+        """Discover and add a peer (distance is computed if not given)"""
         if peer_node.node_id == self.node_id or not peer_node.online:
             return
         
-        distance = self._calculate_distance(peer_node)
+        if distance is None:
+            distance = self._calculate_distance(peer_node)
         
-        # Only add peer if within range (arbitrary: 300 units)
-        if distance <= 300:
-            self.peers[peer_node.node_id] = {
-                'name': peer_node.node_name,
-                'distance': distance,
-                'latency': distance / 10.0,  # Simulated latency
-                'node': peer_node
-            }
-            print(f"🔍 {self.node_name}: Discovered {peer_node.node_name} (distance: {distance:.1f})")
-            print(f"🔐 {self.node_name} <-> {peer_node.node_name}: Executed Diffie-Hellman Key Exchange (derived secure AES session key)")
+        # Only add peer if within range
+        if distance <= DISCOVERY_RANGE:
+            self._add_peer(peer_node, distance)
+    
+    def _add_peer(self, peer_node, distance):
+        """Record an in-range peer at an already computed distance"""
+        self.peers[peer_node.node_id] = PeerInfo(
+            name=peer_node.node_name,
+            distance=distance,
+            latency=distance / 10.0,  # Simulated latency
+            node=peer_node
+        )
+        print(f"🔍 {self.node_name}: Discovered {peer_node.node_name} (distance: {distance:.1f})")
+        print(f"🔐 {self.node_name} <-> {peer_node.node_name}: Executed Diffie-Hellman Key Exchange (derived secure AES session key)")
     
     def _calculate_distance(self, peer_node):
         """Calculate Euclidean distance to peer"""
@@ -100,21 +177,21 @@ class SimulatedNode:
             src_node = all_nodes[shortest_path[idx]]
             next_node = all_nodes[shortest_path[idx+1]]
             print(f"📢 {src_node.node_name}: Broadcasted AODV RREQ #{rreq_id} for destination node {dest_id}")
-            time.sleep(0.05)
+            self._elapse(50)
             print(f"📥 {next_node.node_name}: Received AODV RREQ #{rreq_id} from {src_node.node_name}")
             
             # Learn reverse route
             next_node.routing_table[self.node_id] = shortest_path[idx]
             
         print(f"🎯 [Destination Reached] {all_nodes[dest_id].node_name} received RREQ, preparing Route Reply (RREP)...")
-        time.sleep(0.1)
+        self._elapse(100)
         
         # Unicast RREP backward
         for idx in range(len(shortest_path) - 1, 0, -1):
             curr_node = all_nodes[shortest_path[idx]]
             prev_node = all_nodes[shortest_path[idx-1]]
             print(f"📤 {curr_node.node_name}: Sent AODV RREP unicast back to {prev_node.node_name}")
-            time.sleep(0.05)
+            self._elapse(50)
             print(f"📥 {prev_node.node_name}: Received AODV RREP, established forward route to {dest_id} via {curr_node.node_name}")
             
             prev_node.routing_table[dest_id] = shortest_path[idx]
@@ -122,8 +199,8 @@ class SimulatedNode:
         print(f"✅ [AODV Dynamic Route Established] {self.node_name} can now communicate with {dest_id}!\n")
         return True
     
-    def send_message(self, dest_id, payload, all_nodes=None):
-        """Send a message to destination"""
+    def send_message(self, dest_id, payload, all_nodes=None, msg_id=None, trace=False):
+        """Send a message to destination (trace=True records the path it takes)"""
         if not self.online:
             return False
             
@@ -131,23 +208,52 @@ class SimulatedNode:
         if dest_id not in self.routing_table and all_nodes:
             self._discover_aodv_route(dest_id, all_nodes)
         
-        message = {
-            'type': 'DATA',
-            'source': self.node_id,
-            'destination': dest_id,
-            'payload': payload,
-            'hop_count': 0,
-            'msg_id': f"{self.node_id}_{time.time()}",
-            'path': [self.node_id],
-            'timestamp': time.time()
-        }
+        message = Message(
+            type='DATA',
+            source=self.node_id,
+            destination=dest_id,
+            payload=payload,
+            hop_count=0,
+            msg_id=msg_id or self.next_msg_id(),
+            path=(),  # each sending node appends itself when tracing
+            timestamp=time.time(),
+            flooded=False,
+            trace=trace
+        )
         
         self.stats['messages_sent'] += 1
         return self._route_message(message)
     
+    def next_msg_id(self):
+        """New message ID packing the source and a per-node sequence number"""
+        return (self.numeric_id << 32) | (next(self.msg_seq) & 0xFFFFFFFF)
+    
+    def _seen_message(self, msg_id):
+        """Record msg_id in the cache; returns True if it was already there"""
+        source, seq = msg_id >> 32, msg_id & 0xFFFFFFFF
+        highest, bits = self.message_windows.get(source, (0, 0))
+        
+        if seq > highest:
+            # Slide the window forward; bit 0 is the highest sequence number.
+            # A jump past the whole window leaves only the new bit
+            gap = seq - highest
+            if gap >= MESSAGE_CACHE_SIZE:
+                bits = 1
+            else:
+                bits = ((bits << gap) | 1) & ((1 << MESSAGE_CACHE_SIZE) - 1)
+            self.message_windows[source] = (seq, bits)
+            return False
+        
+        # Too old to tell apart is treated as seen
+        offset = highest - seq
+        if offset >= MESSAGE_CACHE_SIZE or bits >> offset & 1:
+            return True
+        self.message_windows[source] = (highest, bits | (1 << offset))
+        return False
+    
     def _route_message(self, message):
         """Route message to destination"""
-        dest_id = message['destination']
+        dest_id = message.destination
         
         # Check if we're the destination
         if dest_id == self.node_id:
@@ -155,7 +261,8 @@ class SimulatedNode:
             return True
         
         # Check for direct peer
-        if dest_id in self.peers and self.peers[dest_id]['node'].online:
+        info = self.peers.get(dest_id)
+        if info is not None and info.node.online:
             return self._forward_to_peer(message, dest_id)
         
         # Use routing table
@@ -168,47 +275,73 @@ class SimulatedNode:
     
     def _forward_to_peer(self, message, peer_id):
         """Forward message to specific peer"""
-        if peer_id not in self.peers:
+        info = self.peers.get(peer_id)
+        if info is None or not info.node.online:
             return False
         
-        peer = self.peers[peer_id]['node']
-        if not peer.online:
+        message = self._next_hop_message(message)
+        if message is None:
             return False
-        
-        # Increment hop count
-        message['hop_count'] += 1
-        message['path'].append(self.node_id)
+        return self._send_to_peer(message, info)
+    
+    def _next_hop_message(self, message, flooded=False):
+        """Copy of message as sent by this node, or None past the hop limit"""
+        # Hop count (and path when tracing) change, the payload is shared
+        path = message.path + (self.node_id,) if message.trace else message.path
+        message = dataclasses.replace(message, hop_count=message.hop_count + 1,
+                                      path=path, flooded=flooded or message.flooded)
         
         # Check hop limit
-        if message['hop_count'] > 5:
+        if message.hop_count > 5:
             print(f"❌ {self.node_name}: Max hops exceeded")
-            return False
-        
-        # Simulate network delay
-        latency = self.peers[peer_id]['latency']
-        time.sleep(latency / 1000.0)  # Convert to seconds
+            return None
+        return message
+    
+    def _send_to_peer(self, message, info):
+        """Deliver an outgoing message copy to an online peer"""
+        peer = info.node
         
-        # Forward to peer
-        success = peer.receive_from_peer(message)
+        def deliver():
+            success = peer.receive_from_peer(message)
+            if success and message.destination != peer.node_id:
+                self.stats['messages_forwarded'] += 1
+            return success
         
-        if success and message['destination'] != peer_id:
-            self.stats['messages_forwarded'] += 1
+        # Without a simulator the hop is delivered immediately
+        if self.simulator is None:
+            return deliver()
         
-        return success
+        # Deliver after the link latency in simulated time
+        self.simulator.schedule(info.latency, deliver)
+        return True
+    
+    def _elapse(self, delay_ms):
+        """Let simulated time pass (no-op outside a simulator)"""
+        if self.simulator:
+            self.simulator.run_until(self.simulator.now + delay_ms)
     
     def _flood_message(self, message):
         """Flood message to all peers"""
-        msg_id = message['msg_id']
+        if self._seen_message(message.msg_id):
+            return False
         
-        if msg_id in self.message_cache:
+        # The source and any traced path nodes have handled this message; don't
+        # send it back (untraced loops are still dropped by the message cache)
+        visited = set(message.path)
+        visited.add(message.source)
+        targets = [info for peer_id, info in self.peers.items()
+                   if peer_id not in visited and info.node.online]
+        if not targets:
             return False
         
-        self.message_cache.add(msg_id)
-        message['flooded'] = True
+        # Every branch of the flood carries the same outgoing copy
+        message = self._next_hop_message(message, flooded=True)
+        if message is None:
+            return False
         
         success_count = 0
-        for peer_id in self.peers:
-            if self._forward_to_peer(message.copy(), peer_id):
+        for info in targets:
+            if self._send_to_peer(message, info):
                 success_count += 1
         
         return success_count > 0
@@ -218,16 +351,12 @@ class SimulatedNode:
         if not self.online:
             return False
         
-        msg_id = message['msg_id']
-        
         # Loop prevention
-        if msg_id in self.message_cache:
+        if self._seen_message(message.msg_id):
             return False
         
-        self.message_cache.add(msg_id)
-        
         # Check if we're the destination
-        if message['destination'] == self.node_id:
+        if message.destination == self.node_id:
             self._receive_message(message)
             return True
         else:
@@ -238,25 +367,21 @@ class SimulatedNode:
         """Process received message at destination"""
         self.stats['messages_received'] += 1
         
-        path_str = ' → '.join(message['path'] + [self.node_id])
-        print(f"📨 {self.node_name}: Received message from {message['source']}")
-        print(f"   Path: {path_str} ({message['hop_count']} hops)")
-        print(f"   Payload: {message['payload']}")
-    
-    def build_routing_table(self, all_nodes):
-        """Build routing table using simple next-hop logic"""
-        self.routing_table.clear()
-        
-        # Direct peers
-        for peer_id in self.peers:
-            self.routing_table[peer_id] = peer_id
+        print(f"📨 {self.node_name}: Received message from {message.source}")
+        if message.trace:
+            path_str = ' → '.join(message.path + (self.node_id,))
+            print(f"   Path: {path_str} ({message.hop_count} hops)")
+        else:
+            print(f"   Hops: {message.hop_count}")
+        print(f"   Payload: {message.payload}")
         
-        # Multi-hop routes through peers
-        for peer_id, peer_info in self.peers.items():
-            peer_node = peer_info['node']
-            for remote_peer_id in peer_node.peers:
-                if remote_peer_id != self.node_id and remote_peer_id not in self.routing_table:
-                    self.routing_table[remote_peer_id] = peer_id
+        if self.on_delivery:
+            self.on_delivery(message)
+    
+    def build_routing_table(self, routes):
+        """Install next-hop routes (dest -> next hop) computed by the simulator"""
+        # Own copy: AODV discovery adds routes to the node's table
+        self.routing_table = dict(routes)
     
     def update_stats(self):
         """Update statistics"""
@@ -271,18 +396,36 @@ class SimulatedNode:
             'node_name': self.node_name,
             'online': self.online,
             'position': self.position,
-            'peers': [
-                {
-                    'id': peer_id,
-                    'name': info['name'],
-                    'distance': info['distance'],
-                    'latency': info['latency'],
-                    'connected': info['node'].online
-                }
-                for peer_id, info in self.peers.items()
-            ],
+            'peers': self._peer_status(),
             'stats': self.stats
         }
+    
+    def _peer_status(self):
+        """Peer list as reported to the dashboard"""
+        return [
+            {
+                'id': peer_id,
+                'name': info.name,
+                'distance': info.distance,
+                'latency': info.latency,
+                'connected': info.node.online
+            }
+            for peer_id, info in self.peers.items()
+        ]
+    
+    def status_json(self, version):
+        """Dashboard report as JSON bytes; only stats are re-serialized while version is unchanged"""
+        self.update_stats()
+        
+        if self.status_cache is None or self.status_cache[0] != version:
+            head = dumps_bytes({
+                'node_id': self.node_id,
+                'node_name': self.node_name,
+                'peers': self._peer_status()
+            })
+            self.status_cache = (version, head[:-1] + b',"stats":')
+        
+        return self.status_cache[1] + dumps_bytes(self.stats) + b'}'
 
 
 class NetworkSimulator:
@@ -292,14 +435,44 @@ class NetworkSimulator:
         self.nodes = {}
         self.dashboard_url = dashboard_url
         self.running = False
+        
+        # One kept-alive connection to the dashboard for all reports
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
         self.sim_thread = None
+        self.sim_stop = threading.Event()  # wakes the reporter out of its interval wait
+        
+        # Circuit breaker: back off exponentially while the dashboard is unreachable
+        self.dashboard_fail_count = 0
+        self.dashboard_retry_at = 0.0
+        
+        # msg_id -> delivered flag, only for messages send_test_message is tracking
+        self.deliveries = {}
+        
+        # Shortest-path routing tables for the current links, keyed by the
+        # frozenset of offline node IDs so failure/recovery cycles reuse them.
+        # relays holds, per node, the nodes its routes pass through
+        self.routing_cache = {}  # offline set -> (tables {node_id: {dest: next hop}}, relays {node_id: set})
+        
+        # Bumped whenever peers or online states change, invalidating cached node reports
+        self.topology_version = 0
+        
+        # Discrete-event clock: link delays are scheduled events, not sleeps
+        self.now = 0.0  # simulated milliseconds
+        self.event_queue = []  # heap of (time, seq, callback)
+        self._event_seq = itertools.count()
         
         print("🚀 NexLattice Network Simulator Starting...")
     
     def create_node(self, node_id, node_name, position=(0, 0)):
         """Create a new simulated node"""
         node = SimulatedNode(node_id, node_name, position)
+        node.on_delivery = self._record_delivery
+        node.simulator = self
         self.nodes[node_id] = node
+        self.routing_cache.clear()
+        self.topology_version += 1
         return node
     
     def create_topology(self, topology_type='line', node_count=5):
@@ -316,10 +489,15 @@ class NetworkSimulator:
         elif topology_type == 'star':
             # Star topology: Central node with others around
             self.create_node("node_001", "Central Node", (200, 200))
-            for i in range(1, node_count):
-                angle = (i / (node_count - 1)) * 2 * 3.14159
-                x = 200 + 150 * math.cos(angle)
-                y = 200 + 150 * math.sin(angle)
+            if NUMPY_AVAILABLE:
+                angles = np.arange(1, node_count) / (node_count - 1) * 2 * np.pi
+                xs = (200 + 150 * np.cos(angles)).tolist()
+                ys = (200 + 150 * np.sin(angles)).tolist()
+            else:
+                angles = [i / (node_count - 1) * 2 * math.pi for i in range(1, node_count)]
+                xs = [200 + 150 * math.cos(angle) for angle in angles]
+                ys = [200 + 150 * math.sin(angle) for angle in angles]
+            for i, (x, y) in enumerate(zip(xs, ys), start=1):
                 self.create_node(f"node_{i+1:03d}", f"Node {i+1}", (x, y))
         
         elif topology_type == 'mesh':
@@ -345,87 +523,199 @@ class NetworkSimulator:
         """Run peer discovery for all nodes"""
         print("🔍 Running peer discovery...")
         
-        # Each node discovers all other nodes within range
+        # Each node discovers all other nodes within range; distance is
+        # symmetric, so every unordered pair is measured once and linked both ways
         nodes_list = list(self.nodes.values())
-        for node in nodes_list:
-            for peer in nodes_list:
-                if node != peer:
-                    node.discover_peer(peer)
+        links_before = sum(len(n.peers) for n in nodes_list)
+        if NUMPY_AVAILABLE and nodes_list:
+            # All pairwise distances in one vectorized pass; only in-range pairs are visited
+            pos = np.array([n.position for n in nodes_list], dtype=np.float64)
+            diff = pos[:, None, :] - pos[None, :, :]
+            distances = np.hypot(diff[..., 0], diff[..., 1])
+            in_range = np.triu(distances <= DISCOVERY_RANGE, k=1)
+            pairs = ((nodes_list[i], nodes_list[j], float(distances[i, j]))
+                     for i, j in zip(*np.nonzero(in_range)))
+        else:
+            pairs = ((a, b, a._calculate_distance(b))
+                     for a, b in itertools.combinations(nodes_list, 2))
+        
+        for a, b, distance in pairs:
+            if distance <= DISCOVERY_RANGE:
+                if b.online:
+                    a._add_peer(b, distance)
+                if a.online:
+                    b._add_peer(a, distance)
+        
+        # Peers are only ever added, so a changed count means new links
+        if sum(len(n.peers) for n in nodes_list) != links_before:
+            self.routing_cache.clear()
+            self.topology_version += 1
         
         # Build routing tables
-        for node in self.nodes.values():
-            node.build_routing_table(self.nodes)
+        self.update_routing_tables()
         
         print("✅ Discovery complete")
         self.print_network_stats()
     
-    def send_test_message(self, source_id, dest_id, payload):
-        """Send a test message through the network"""
+    def update_routing_tables(self, failed_id=None):
+        """Install shortest-path routing tables on all online nodes"""
+        offline = frozenset(node_id for node_id, node in self.nodes.items() if not node.online)
+        entry = self.routing_cache.get(offline)
+        if entry is None:
+            previous = self.routing_cache.get(offline - {failed_id}) if failed_id else None
+            if previous is not None:
+                entry = self._routes_without(previous, failed_id)
+            else:
+                entry = ({}, {})
+                for node_id, node in self.nodes.items():
+                    if node.online:
+                        entry[0][node_id], entry[1][node_id] = self._next_hops_from(node_id)
+            self.routing_cache[offline] = entry
+        
+        for node_id, routes in entry[0].items():
+            self.nodes[node_id].build_routing_table(routes)
+    
+    def _routes_without(self, previous, failed_id):
+        """Derive routing tables after failed_id goes offline from the tables before it"""
+        prev_tables, prev_relays = previous
+        tables, relays = {}, {}
+        
+        for node_id, routes in prev_tables.items():
+            if node_id == failed_id:
+                continue
+            if failed_id in prev_relays[node_id]:
+                # Some route ran through the failed node; search again
+                tables[node_id], relays[node_id] = self._next_hops_from(node_id)
+            else:
+                # At most a leaf of this node's BFS tree: drop it, the rest still holds
+                if failed_id in routes:
+                    routes = {dest: hop for dest, hop in routes.items() if dest != failed_id}
+                tables[node_id], relays[node_id] = routes, prev_relays[node_id]
+        
+        return tables, relays
+    
+    def _next_hops_from(self, source_id):
+        """BFS over online links from source_id; returns ({dest: first hop}, relay nodes)"""
+        next_hops = {}
+        relays = set()
+        queue = deque()
+        
+        for peer_id in self.nodes[source_id].peers:
+            peer = self.nodes.get(peer_id)
+            if peer and peer.online:
+                next_hops[peer_id] = peer_id
+                queue.append(peer_id)
+        
+        while queue:
+            current_id = queue.popleft()
+            for neighbor_id in self.nodes[current_id].peers:
+                if neighbor_id == source_id or neighbor_id in next_hops:
+                    continue
+                neighbor = self.nodes.get(neighbor_id)
+                if neighbor and neighbor.online:
+                    next_hops[neighbor_id] = next_hops[current_id]
+                    relays.add(current_id)
+                    queue.append(neighbor_id)
+        
+        return next_hops, relays
+    
+    def send_test_message(self, source_id, dest_id, payload, trace=False):
+        """Send a test message through the network; returns its msg_id, or None on failure"""
         if source_id not in self.nodes:
             print(f"❌ Source node {source_id} not found")
-            return False
+            return None
         
         if dest_id not in self.nodes:
             print(f"❌ Destination node {dest_id} not found")
-            return False
+            return None
         
         source = self.nodes[source_id]
         print(f"\n📤 Sending message: {source_id} → {dest_id}")
         print(f"   Payload: {payload}")
         
-        success = source.send_message(dest_id, payload, self.nodes)
+        msg_id = source.next_msg_id()
+        sent_at = self.now
+        self.deliveries[msg_id] = False
+        source.send_message(dest_id, payload, self.nodes, msg_id=msg_id, trace=trace)
         
-        if success:
-            print("✅ Message delivery successful\n")
-        else:
-            print("❌ Message delivery failed\n")
+        # Play out the hops; delivery is recorded by the destination's hook
+        self.run_until()
+        
+        if self.deliveries.pop(msg_id):
+            print(f"✅ Message delivery successful ({self.now - sent_at:.1f} ms simulated)\n")
+            return msg_id
+        
+        print("❌ Message delivery failed\n")
+        return None
+    
+    def schedule(self, delay_ms, callback):
+        """Run callback after delay_ms of simulated time"""
+        heapq.heappush(self.event_queue, (self.now + delay_ms, next(self._event_seq), callback))
+    
+    def run_until(self, end_time=None):
+        """Process events due by end_time (all pending events if None), advancing the clock"""
+        queue = self.event_queue
+        while queue and (end_time is None or queue[0][0] <= end_time):
+            self.now, _, callback = heapq.heappop(queue)
+            callback()
         
-        return success
+        if end_time is not None and end_time > self.now:
+            self.now = end_time
+    
+    def _record_delivery(self, message):
+        """Mark a tracked message as delivered"""
+        if message.msg_id in self.deliveries:
+            self.deliveries[message.msg_id] = True
     
     def simulate_node_failure(self, node_id):
         """Simulate a node going offline"""
         if node_id in self.nodes:
             self.nodes[node_id].online = False
+            self.topology_version += 1
             print(f"💥 Node {node_id} went offline")
             
-            # Rebuild routing tables
-            for node in self.nodes.values():
-                if node.online:
-                    node.build_routing_table(self.nodes)
+            # Rebuild only the routing tables that went through the failed node
+            self.update_routing_tables(failed_id=node_id)
     
     def simulate_node_recovery(self, node_id):
         """Simulate a node coming back online"""
         if node_id in self.nodes:
             self.nodes[node_id].online = True
+            self.topology_version += 1
             print(f"✅ Node {node_id} recovered")
             
             # Re-run discovery
             self.run_discovery()
     
     def report_to_dashboard(self):
-        """Report node status to dashboard"""
-        for node in self.nodes.values():
-            status = node.get_status()
-            
-            try:
-                response = requests.post(
-                    f"{self.dashboard_url}/api/update_node",
-                    json={
-                        'node_id': status['node_id'],
-                        'node_name': status['node_name'],
-                        'peers': status['peers'],
-                        'stats': status['stats']
-                    },
-                    timeout=2
-                )
-                
-                if response.status_code != 200:
-                    print(f"⚠️  Dashboard update failed for {node.node_id}")
+        """Report all node statuses to dashboard in one request"""
+        if time.monotonic() < self.dashboard_retry_at:
+            return False
+        
+        body = b'{"nodes":[' + b','.join(
+            node.status_json(self.topology_version) for node in self.nodes.values()
+        ) + b']}'
+        
+        try:
+            response = self.session.post(
+                f"{self.dashboard_url}/api/update_nodes",
+                data=body,
+                headers={'Content-Type': 'application/json'},
+                timeout=2
+            )
             
-            except requests.exceptions.RequestException as e:
-                print(f"⚠️  Could not connect to dashboard: {e}")
+            if response.status_code != 200:
+                print(f"⚠️  Dashboard update failed ({response.status_code})")
                 return False
         
+        except requests.exceptions.RequestException as e:
+            backoff = min(60, 2 ** self.dashboard_fail_count)
+            self.dashboard_fail_count += 1
+            self.dashboard_retry_at = time.monotonic() + backoff
+            print(f"⚠️  Could not connect to dashboard: {e} (retrying in {backoff}s)")
+            return False
+        
+        self.dashboard_fail_count = 0
         return True
     
     def print_network_stats(self):
@@ -456,11 +746,12 @@ class NetworkSimulator:
     def start_continuous_sim(self, interval=10):
         """Start continuous simulation with periodic dashboard updates"""
         self.running = True
+        self.sim_stop.clear()
         
         def sim_loop():
             while self.running:
                 self.report_to_dashboard()
-                time.sleep(interval)
+                self.sim_stop.wait(interval)
         
         self.sim_thread = threading.Thread(target=sim_loop, daemon=True)
         self.sim_thread.start()
@@ -469,14 +760,15 @@ class NetworkSimulator:
     def stop_continuous_sim(self):
         """Stop continuous simulation"""
         self.running = False
+        self.sim_stop.set()
         if self.sim_thread:
             self.sim_thread.join()
+            self.sim_thread = None
         print("⏹️  Continuous simulation stopped")
 
 
 def main():
     """Example simulation"""
-    import math
     
     # Create simulator
     sim = NetworkSimulator()
@@ -493,7 +785,7 @@ def main():
     
     # Test multi-hop message
     print("\n--- Test 2: Multi-Hop Message ---")
-    sim.send_test_message("node_001", "node_005", "Hello from the other side!")
+    sim.send_test_message("node_001", "node_005", "Hello from the other side!", trace=True)
     
     # Test node failure
     print("\n--- Test 3: Node Failure ---")